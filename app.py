@@ -1,16 +1,31 @@
 """Flask application for CBSE Papers Archive"""
 import os
-import io
 import zipfile
-import requests
 import time
 import re
-import hashlib
-from flask import Flask, render_template, jsonify, request, send_file, Response, stream_with_context
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, render_template, jsonify, request, send_file, Response
 from flask_cors import CORS
 from database import (
-    init_db, seed_initial_data, get_all_subjects, get_all_years,
-    get_all_regions, get_papers, get_paper_by_id, get_db, add_missing_years
+    init_db, seed_initial_data, get_paper_by_id, get_papers_by_ids, release_read_db,
+    add_missing_years
+)
+from fetch import fetcher, VALIDATORS_SUFFIX
+from singleflight import single_flight, atomic_write_bytes
+from zipstream import ZipStream, can_copy_raw
+from bundle_cache import BundleCache
+from cache_manager import CacheManager
+from hot_pdfs import HotPdfCache
+from timings import StageTimings
+from preextract import PreExtractor, extract_archive_to_cache
+from paper_files import paper_cache_path, existing_pdf_path
+from catalog import Catalog, PAPER_FIELDS, InvalidCursor, encode_cursor, decode_cursor, brotli
+from search import search_papers, search_content
+from zip_index import (
+    ZipMemberRef, INDEX_SUFFIX, zip_cache_path, build_zip_index, load_zip_index,
+    find_member, read_member, iter_member_raw
 )
 
 app = Flask(__name__)
@@ -20,18 +35,62 @@ CORS(app)
 app.config['PAPERS_DIR'] = os.path.join(os.path.dirname(__file__), 'static', 'papers')
 app.config['CACHE_DIR'] = os.path.join(os.path.dirname(__file__), 'cache')
 app.config['ZIP_CACHE_DIR'] = os.path.join(os.path.dirname(__file__), 'zip_cache')
+# Disk budgets for extracted PDFs and downloaded CBSE archives (least recently used go first)
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_BYTES', 1024 ** 3))
+app.config['ZIP_CACHE_MAX_BYTES'] = int(os.environ.get('ZIP_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Optional shared-memory copies of the most requested PDFs, served by every worker
+app.config['HOT_PDF_CACHE'] = os.environ.get('HOT_PDF_CACHE', '').lower() in ('1', 'true', 'yes')
+app.config['HOT_PDF_DIR'] = os.environ.get('HOT_PDF_DIR', '/dev/shm/cbse-hot-pdfs')
+app.config['HOT_PDF_COUNT'] = int(os.environ.get('HOT_PDF_COUNT', 50))
+app.config['HOT_PDF_MAX_BYTES'] = int(os.environ.get('HOT_PDF_MAX_BYTES', 48 * 1024 ** 2))
+app.config['HOT_PDF_MIN_REQUESTS'] = int(os.environ.get('HOT_PDF_MIN_REQUESTS', 3))
+# Paper IDs whose extracted PDFs are never evicted from cache/
+app.config['PINNED_PAPERS'] = [int(pid) for pid in os.environ.get('PINNED_PAPERS', '').split(',') if pid.strip()]
+# Bulk ZIP entry compression ('stored' or 'deflated') and whether PDFs not yet
+# in cache/ are copied compressed straight out of the CBSE ZIP
+app.config['BULK_ZIP_COMPRESSION'] = os.environ.get('BULK_ZIP_COMPRESSION', 'stored')
+app.config['BULK_ZIP_RAW_COPY'] = os.environ.get('BULK_ZIP_RAW_COPY', '1').lower() in ('1', 'true', 'yes')
+# Prebuilt bulk-download bundles and their disk budget
+app.config['BUNDLE_CACHE_DIR'] = os.path.join(os.path.dirname(__file__), 'bundle_cache')
+app.config['BUNDLE_CACHE_MAX_BYTES'] = int(os.environ.get('BUNDLE_CACHE_MAX_BYTES', 1024 ** 3))
+# Lock files coordinating cache fills across threads and gunicorn workers
+app.config['LOCK_DIR'] = os.path.join(os.path.dirname(__file__), '.locks')
+# Browser cache lifetime (seconds) for downloaded PDFs; they never change once extracted
+app.config['PDF_MAX_AGE'] = int(os.environ.get('PDF_MAX_AGE', 86400))
+# Let a fronting nginx/Apache serve the file itself via X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+# Extract every paper of a CBSE archive into cache/ in the background as soon as it is downloaded
+app.config['PREEXTRACT_ON_INGEST'] = os.environ.get('PREEXTRACT_ON_INGEST', '').lower() in ('1', 'true', 'yes')
+# How often (seconds) the in-memory catalog checks the database for changes
+app.config['CATALOG_CHECK_INTERVAL'] = float(os.environ.get('CATALOG_CHECK_INTERVAL', 2))
+# Browser/CDN cache lifetime (seconds) for catalog JSON; revalidated by ETag afterwards
+app.config['CATALOG_MAX_AGE'] = int(os.environ.get('CATALOG_MAX_AGE', 60))
+# Default and maximum page sizes for paginated /api/papers requests
+app.config['PAPERS_PAGE_SIZE'] = 100
+app.config['PAPERS_PAGE_MAX'] = 1000
 
 # Ensure directories exist
 os.makedirs(app.config['PAPERS_DIR'], exist_ok=True)
 os.makedirs(app.config['CACHE_DIR'], exist_ok=True)
 os.makedirs(app.config['ZIP_CACHE_DIR'], exist_ok=True)
+os.makedirs(app.config['LOCK_DIR'], exist_ok=True)
 
-# Request headers to mimic browser
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept': '*/*',
-    'Accept-Language': 'en-US,en;q=0.9',
-}
+bundle_cache = BundleCache(app.config['BUNDLE_CACHE_DIR'], app.config['BUNDLE_CACHE_MAX_BYTES'])
+pdf_cache = CacheManager(app.config['CACHE_DIR'], app.config['CACHE_MAX_BYTES'], '.pdf')
+zip_cache = CacheManager(app.config['ZIP_CACHE_DIR'], app.config['ZIP_CACHE_MAX_BYTES'], '.zip',
+                         companions=(INDEX_SUFFIX, VALIDATORS_SUFFIX))
+# Done at import so every worker (gunicorn included) starts from pinned, in-budget caches
+for paper_id in app.config['PINNED_PAPERS']:
+    pdf_cache.pin(paper_cache_path(app.config['CACHE_DIR'], paper_id))
+for cache in (pdf_cache, zip_cache):
+    cache.sync()
+    cache.evict()
+catalog = Catalog(app.config['CATALOG_CHECK_INTERVAL'])
+hot_pdfs = HotPdfCache(
+    app.config['HOT_PDF_DIR'], app.config['HOT_PDF_COUNT'],
+    app.config['HOT_PDF_MAX_BYTES'], app.config['HOT_PDF_MIN_REQUESTS']
+) if app.config['HOT_PDF_CACHE'] else None
+pre_extractor = PreExtractor()
 
 # CBSE Official ZIP URLs
 CBSE_ZIP_URLS = {
@@ -117,6 +176,15 @@ CBSE_ZIP_URLS = {
     },
 }
 
+# Compression modes accepted for bulk ZIP downloads
+ZIP_COMPRESSION_MODES = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+}
+
+# Orders bulk-download results can be streamed in
+DOWNLOAD_ORDERS = ('requested', 'completed')
+
 # Subject name mapping
 SUBJECT_KEY_MAP = {
     'Accountancy': 'accountancy',
@@ -127,6 +195,12 @@ SUBJECT_KEY_MAP = {
     'English Core': 'english_core'
 }
 
+# Year and subject name of each archive, for mapping its members to papers
+CBSE_ARCHIVES = {
+    url: (year, subject)
+    for year, subjects in CBSE_ZIP_URLS.items() for subject, url in subjects.items()
+}
+
 def get_cbse_zip_url(year, subject_name):
     """Get CBSE ZIP URL for a subject/year"""
     subject_key = SUBJECT_KEY_MAP.get(subject_name)
@@ -134,71 +208,82 @@ def get_cbse_zip_url(year, subject_name):
         return CBSE_ZIP_URLS[year][subject_key]
     return None
 
-def download_cbse_zip(url):
-    """Download CBSE ZIP file and cache it"""
-    # Create cache key from URL
-    cache_key = hashlib.md5(url.encode()).hexdigest()
-    cache_path = os.path.join(app.config['ZIP_CACHE_DIR'], f"{cache_key}.zip")
+def download_cbse_zip(url, hold=None):
+    """Download CBSE ZIP file into the ZIP cache and return its path
+    
+    With a `hold` token the archive is held in the ZIP cache until the token
+    is released.
+    """
+    cache_path = zip_cache_path(url, app.config['ZIP_CACHE_DIR'])
+    if hold:
+        zip_cache.hold(hold, cache_path)
     
     # Check cache
     if os.path.exists(cache_path):
-        with open(cache_path, 'rb') as f:
-            return f.read()
-    
-    # Download
-    try:
-        print(f"Downloading ZIP from {url}")
-        response = requests.get(url, headers=HEADERS, timeout=120)
-        if response.status_code == 200:
-            # Cache the ZIP
-            with open(cache_path, 'wb') as f:
-                f.write(response.content)
-            return response.content
-    except Exception as e:
-        print(f"Error downloading ZIP: {e}")
+        zip_cache.hit(cache_path)
+        return cache_path
+    
+    # Only one thread/worker fetches a given archive; the rest wait for it
+    with single_flight(cache_path, app.config['LOCK_DIR']):
+        if os.path.exists(cache_path):
+            zip_cache.hit(cache_path)
+            return cache_path
+        
+        zip_cache.miss()
+        try:
+            print(f"Downloading ZIP from {url}")
+            # Streamed to disk in chunks; an interrupted download resumes next time
+            fetcher.download_to_file(url, cache_path)
+        except Exception as e:
+            print(f"Error downloading ZIP: {e}")
+            return None
+        
+        try:
+            # Index the central directory once; this also rejects corrupt archives
+            build_zip_index(cache_path)
+        except zipfile.BadZipFile as e:
+            print(f"Downloaded ZIP is corrupt: {e}")
+            os.unlink(cache_path)
+            return None
+        zip_cache.add(cache_path)
+        
+        if app.config['PREEXTRACT_ON_INGEST'] and url in CBSE_ARCHIVES:
+            year, subject = CBSE_ARCHIVES[url]
+            future = pre_extractor.submit(cache_path, year, subject, app.config['CACHE_DIR'])
+            if future:
+                future.add_done_callback(lambda f: pdf_cache.add(*f.result().values()))
+        return cache_path
     
     return None
 
-def extract_pdf_from_zip(zip_content, paper_title, set_code):
-    """Extract a specific PDF from a ZIP file based on paper title and set"""
+def extract_pdf_from_zip(zip_path, paper_title, set_code):
+    """Extract a specific PDF from a cached ZIP file based on paper title and set"""
     try:
-        zip_buffer = io.BytesIO(zip_content)
-        with zipfile.ZipFile(zip_buffer, 'r') as zf:
-            pdf_files = [f for f in zf.namelist() if f.lower().endswith('.pdf')]
-            
-            # Try to find matching PDF
-            # Extract set number from set_code (e.g., "Set 1" -> "1")
-            set_num = set_code.replace('Set ', '') if set_code else '1'
-            
-            for pdf_file in pdf_files:
-                pdf_name_lower = pdf_file.lower()
-                # Match by set number in filename
-                if f'-{set_num}-' in pdf_name_lower or f'_{set_num}_' in pdf_name_lower or f'set{set_num}' in pdf_name_lower:
-                    return zf.read(pdf_file), os.path.basename(pdf_file)
-            
-            # If no specific match, return first PDF
-            if pdf_files:
-                return zf.read(pdf_files[0]), os.path.basename(pdf_files[0])
-                
+        index = load_zip_index(zip_path)
+        member = find_member(index, set_code)
+        if member:
+            return read_member(zip_path, member), os.path.basename(member['name'])
     except Exception as e:
         print(f"Error extracting PDF: {e}")
     
     return None, None
 
-def get_pdf_for_paper(paper):
-    """Get PDF content for a paper"""
-    paper_id = paper['id']
-    cache_path = os.path.join(app.config['CACHE_DIR'], f"paper_{paper_id}.pdf")
-    
-    # Check cache first
-    if os.path.exists(cache_path):
-        with open(cache_path, 'rb') as f:
-            return f.read()
-    
-    # Check local file
-    if paper.get('local_path') and os.path.exists(paper['local_path']):
-        with open(paper['local_path'], 'rb') as f:
-            return f.read()
+def get_paper_cache_path(paper):
+    """Get the cache/ path a paper's extracted PDF is stored under"""
+    return paper_cache_path(app.config['CACHE_DIR'], paper['id'])
+
+def get_existing_pdf_path(paper):
+    """Get the path of a paper's PDF if it is already cached or stored locally"""
+    return existing_pdf_path(paper, app.config['CACHE_DIR'])
+
+def get_pdf_path_for_paper(paper):
+    """Get the on-disk path of a paper's PDF, extracting it into the cache if needed"""
+    cache_path = get_paper_cache_path(paper)
+    existing_path = get_existing_pdf_path(paper)
+    if existing_path:
+        if existing_path == cache_path:
+            pdf_cache.hit(cache_path)
+        return existing_path
     
     # Try to get from CBSE ZIP
     year = paper.get('year')
@@ -206,58 +291,166 @@ def get_pdf_for_paper(paper):
     set_code = paper.get('set_code')
     
     zip_url = get_cbse_zip_url(year, subject_name)
-    if zip_url:
-        zip_content = download_cbse_zip(zip_url)
-        if zip_content:
-            pdf_content, pdf_name = extract_pdf_from_zip(zip_content, paper['title'], set_code)
+    if not zip_url:
+        return None
+    
+    pdf_cache.miss()
+    with single_flight(cache_path, app.config['LOCK_DIR']):
+        # Another request may have extracted it while we waited
+        if os.path.exists(cache_path):
+            return cache_path
+        
+        zip_path = download_cbse_zip(zip_url)
+        if zip_path:
+            pdf_content, pdf_name = extract_pdf_from_zip(zip_path, paper['title'], set_code)
             if pdf_content:
                 # Cache the extracted PDF
-                with open(cache_path, 'wb') as f:
-                    f.write(pdf_content)
-                return pdf_content
+                atomic_write_bytes(cache_path, pdf_content)
+                pdf_cache.add(cache_path)
+                return cache_path
     
     return None
 
+def get_serving_path(paper, pdf_path):
+    """Get the path to serve a paper's PDF from, preferring the shared-memory tier"""
+    if hot_pdfs:
+        return hot_pdfs.request(paper['id'], pdf_path)
+    return pdf_path
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Return the thread's read connection to a clean state after each request"""
+    release_read_db()
+
 @app.route('/')
 def index():
     """Render the main page"""
     return render_template('index.html')
 
+def choose_encoding():
+    """Pick the best response encoding the client accepts"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def catalog_response(key, build, cacheable=True):
+    """Serve catalog JSON with a version ETag, CDN caching headers and a cached body
+
+    `build(snapshot)` returns the data to serialize; it is only called the first
+    time `key` is requested for a catalog version. `cacheable` (a bool, or a
+    function of the snapshot) decides whether the body is kept at all.
+    """
+    snapshot = catalog.get()
+    if callable(cacheable):
+        cacheable = cacheable(snapshot)
+    encoding, data = snapshot.encoded_body(
+        key, lambda: app.json.dumps(build(snapshot), separators=(',', ':')).encode(),
+        choose_encoding(), cacheable,
+    )
+    etag = snapshot.etag_for(key) + (f"-{encoding}" if encoding else '')
+
+    max_age = app.config['CATALOG_MAX_AGE']
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f"public, max-age={max_age}, stale-while-revalidate={max_age * 5}",
+        'Vary': 'Accept-Encoding',
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    response = Response(data, mimetype='application/json', headers=headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/api/subjects')
 def api_subjects():
     """Get all subjects"""
-    subjects = get_all_subjects()
-    return jsonify(subjects)
+    return catalog_response(('subjects',), lambda snapshot: snapshot.subjects)
 
 @app.route('/api/years')
 def api_years():
     """Get all years"""
-    years = get_all_years()
-    return jsonify(years)
+    return catalog_response(('years',), lambda snapshot: snapshot.years)
 
 @app.route('/api/regions')
 def api_regions():
     """Get all regions"""
-    regions = get_all_regions()
-    return jsonify(regions)
+    return catalog_response(('regions',), lambda snapshot: snapshot.regions)
 
 @app.route('/api/papers')
 def api_papers():
-    """Get papers with optional filters"""
+    """Get papers with optional filters
+    
+    Without `limit` or `cursor` the full list is returned as an array. With
+    them the response is one page: {"papers": [...], "next_cursor": ...,
+    "total": ... (with include_total=1)}. `fields` limits each paper to the
+    listed keys.
+    """
     subject_id = request.args.get('subject_id', type=int)
     year_id = request.args.get('year_id', type=int)
     region_id = request.args.get('region_id', type=int)
     paper_type = request.args.get('paper_type')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total', '').lower() in ('1', 'true', 'yes')
+    
+    fields = PAPER_FIELDS
+    if request.args.get('fields'):
+        requested = {field.strip() for field in request.args['fields'].split(',') if field.strip()}
+        unknown = sorted(requested.difference(PAPER_FIELDS))
+        if unknown or not requested:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        # Canonical order without repeats, so equivalent requests share a cache entry
+        fields = tuple(field for field in PAPER_FIELDS if field in requested)
+    
+    # Filter values that match nothing are answered but not cached
+    def known_filters(snapshot):
+        return snapshot.has_filter_values(subject_id, year_id, region_id, paper_type)
+    
+    if limit is None and cursor is None:
+        return catalog_response(
+            ('papers', subject_id, year_id, region_id, paper_type, fields),
+            lambda snapshot: [
+                paper.to_dict(fields)
+                for paper in snapshot.filter(subject_id, year_id, region_id, paper_type)
+            ],
+            known_filters,
+        )
     
-    papers = get_papers(subject_id, year_id, region_id, paper_type)
-    return jsonify(papers)
+    limit = min(max(limit or app.config['PAPERS_PAGE_SIZE'], 1), app.config['PAPERS_PAGE_MAX'])
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    def build_page(snapshot):
+        positions = snapshot.filter_positions(subject_id, year_id, region_id, paper_type)
+        papers, last = snapshot.page(positions, after, limit)
+        page = {
+            'papers': [paper.to_dict(fields) for paper in papers],
+            'next_cursor': encode_cursor(last) if last else None,
+        }
+        if include_total:
+            page['total'] = len(positions)
+        return page
+    
+    # Only first pages are cached; later pages are cheap slices keyed on
+    # arbitrary cursors, so caching them would only churn the body cache
+    return catalog_response(
+        ('papers', subject_id, year_id, region_id, paper_type, fields, after, limit, include_total),
+        build_page,
+        lambda snapshot: after is None and known_filters(snapshot),
+    )
 
 @app.route('/api/papers/<int:paper_id>')
 def api_paper_detail(paper_id):
     """Get a single paper by ID"""
-    paper = get_paper_by_id(paper_id)
+    paper = catalog.get().by_id.get(paper_id)
     if paper:
-        return jsonify(paper)
+        return jsonify(paper.to_dict())
     return jsonify({'error': 'Paper not found'}), 404
 
 @app.route('/api/download/<int:paper_id>')
@@ -271,15 +464,23 @@ def download_paper(paper_id):
     safe_title = paper['title'].replace(' ', '_').replace('/', '-').replace('(', '').replace(')', '')
     filename = f"{safe_title}.pdf"
     
-    # Try to get PDF content
-    pdf_content = get_pdf_for_paper(paper)
+    # Serve straight from disk so the server can use sendfile and answer
+    # Range / If-None-Match / If-Modified-Since without reading the PDF
+    pdf_path = get_pdf_path_for_paper(paper)
     
-    if pdf_content:
+    if pdf_path:
+        # Validators come from the source file, so they stay the same when
+        # the paper is served from its copy in the shared-memory tier
+        source = os.stat(pdf_path)
         return send_file(
-            io.BytesIO(pdf_content),
+            get_serving_path(paper, pdf_path),
             as_attachment=True,
             download_name=filename,
-            mimetype='application/pdf'
+            mimetype='application/pdf',
+            conditional=True,
+            etag=f"{paper_id}-{source.st_mtime_ns}-{source.st_size}",
+            last_modified=source.st_mtime,
+            max_age=app.config['PDF_MAX_AGE']
         )
     
     # If direct download fails, return error with source URL
@@ -290,162 +491,403 @@ def download_paper(paper_id):
         'message': 'Please visit the source URL to download the paper'
     }), 404
 
-def download_paper_task(paper_id):
-    """Task to download a single paper - used for parallel downloads"""
-    paper = get_paper_by_id(paper_id)
-    if not paper:
-        return None, None, None
-    
+def get_download_filename(paper):
+    """Get the file name a paper gets inside a bulk-download ZIP"""
     safe_title = paper['title'].replace(' ', '_').replace('/', '-').replace('(', '').replace(')', '')
-    filename = f"{safe_title}.pdf"
+    return f"{safe_title}.pdf"
+
+def get_download_error(paper):
+    """Describe a paper that could not be fetched, for the ZIP's README"""
+    zip_url = get_cbse_zip_url(paper.get('year'), paper.get('subject_name'))
+    return {
+        'title': paper['title'],
+        'url': zip_url or paper.get('pdf_url', 'N/A')
+    }
+
+def download_archive_papers(zip_url, papers, raw_copy=False, timings=None, hold=None):
+    """Fetch one CBSE archive and get all of the given papers out of it
+    
+    The archive is downloaded (or found in the ZIP cache) and indexed once,
+    then every needed member is extracted in a single pass over the file.
+    Returns {paper_id: source}, where source is the cached PDF's path or,
+    with raw_copy, a reference to the still-compressed member. Members that
+    cannot be copied raw (other compression methods, Zip64 sizes) are
+    extracted to the cache instead. With a `hold` token the archive and the
+    extracted PDFs are held in their caches until the token is released.
+    """
+    timings = timings or StageTimings()
+    with timings.stage('fetch'):
+        zip_path = download_cbse_zip(zip_url, hold)
+    if not zip_path:
+        return {}
+    try:
+        with timings.stage('index'):
+            index = load_zip_index(zip_path)
+    except Exception as e:
+        print(f"Error reading ZIP index: {e}")
+        return {}
+    
+    refs = {}
+    if raw_copy:
+        to_extract = []
+        for paper in papers:
+            member = find_member(index, paper.get('set_code'))
+            if member and can_copy_raw(member):
+                refs[paper['id']] = ZipMemberRef(zip_path, member)
+            elif member:
+                to_extract.append(paper)
+        papers = to_extract
+        if not papers:
+            return refs
+    
+    sources = extract_archive_to_cache(zip_path, papers, app.config['CACHE_DIR'], index, timings)
+    if hold:
+        pdf_cache.hold(hold, *sources.values())
+    pdf_cache.add(*sources.values())
+    sources.update(refs)
+    return sources
+
+def plan_downloads(papers):
+    """Split a selection into papers already on disk and papers grouped by CBSE archive
+    
+    Returns ({paper_id: path}, {zip_url: [papers]}); papers with neither have
+    no source.
+    """
+    ready = {}
+    by_archive = {}
+    for paper in papers:
+        path = get_existing_pdf_path(paper)
+        if path:
+            if path == get_paper_cache_path(paper):
+                pdf_cache.hit(path)
+            ready[paper['id']] = path
+            continue
+        zip_url = get_cbse_zip_url(paper.get('year'), paper.get('subject_name'))
+        if zip_url:
+            by_archive.setdefault(zip_url, []).append(paper)
+    pdf_cache.miss(sum(len(archive_papers) for archive_papers in by_archive.values()))
+    return ready, by_archive
+
+def iter_download_results(executor, papers, order='requested', raw_copy=False, timings=None):
+    """Fetch papers one archive per task and yield (filename, source, error) per paper
+    
+    Papers already on disk are yielded without waiting on any archive. With
+    order='requested' results follow the selection order; with 'completed'
+    each archive's papers are yielded as soon as it is done. Work is spread
+    across archives, never across papers of the same archive. Every source
+    is held in its cache until the generator is finished or closed.
+    """
+    timings = timings or StageTimings()
+    hold = uuid.uuid4().hex
+    with timings.stage('plan'):
+        ready, by_archive = plan_downloads(papers)
+        pdf_cache.hold(hold, *ready.values())
+    print(f"Bulk download plan: {len(papers)} papers, {len(ready)} on disk, "
+          f"{sum(len(group) for group in by_archive.values())} from {len(by_archive)} archives")
+    
+    # Archives are submitted in the order their first paper was requested
+    futures = {
+        zip_url: executor.submit(download_archive_papers, zip_url, group, raw_copy, timings, hold)
+        for zip_url, group in by_archive.items()
+    }
+    archive_of = {
+        paper['id']: zip_url for zip_url, group in by_archive.items() for paper in group
+    }
+    
+    def archive_sources(zip_url):
+        try:
+            return futures[zip_url].result()
+        except Exception as e:
+            print(f"Error downloading papers from {zip_url}: {e}")
+            return {}
+    
+    def result_for(paper, source):
+        if source:
+            return get_download_filename(paper), source, None
+        return get_download_filename(paper), None, get_download_error(paper)
     
-    # Try to get PDF content
-    pdf_content = get_pdf_for_paper(paper)
+    try:
+        if order == 'completed':
+            for paper in papers:
+                if paper['id'] not in archive_of:
+                    yield result_for(paper, ready.get(paper['id']))
+            zip_url_of = {future: zip_url for zip_url, future in futures.items()}
+            for future in as_completed(zip_url_of):
+                zip_url = zip_url_of[future]
+                sources = archive_sources(zip_url)
+                for paper in by_archive[zip_url]:
+                    yield result_for(paper, sources.get(paper['id']))
+        else:
+            for paper in papers:
+                zip_url = archive_of.get(paper['id'])
+                if zip_url is None:
+                    yield result_for(paper, ready.get(paper['id']))
+                else:
+                    yield result_for(paper, archive_sources(zip_url).get(paper['id']))
+    finally:
+        pdf_cache.release(hold)
+        zip_cache.release(hold)
+
+def papers_zip_chunks(results, compression, failed_papers):
+    """Yield ZIP archive bytes for download results, collecting the failures"""
+    archive = ZipStream(compression=compression)
+    for filename, source, error in results:
+        if isinstance(source, ZipMemberRef):
+            # Copy the member's compressed bytes straight from the CBSE ZIP
+            member = source.member
+            yield from archive.add_raw(
+                filename, iter_member_raw(source.zip_path, member),
+                member['compress_type'], member['crc'],
+                member['compress_size'], member['file_size']
+            )
+        elif source:
+            yield from archive.add_file(filename, source)
+        elif error:
+            failed_papers.append(error)
+    
+    # Add a readme if some downloads failed
+    if failed_papers:
+        readme_content = "Some papers could not be downloaded directly.\n"
+        readme_content += "Please download them manually from the following URLs:\n\n"
+        for fp in failed_papers:
+            readme_content += f"- {fp['title']}\n  URL: {fp['url']}\n\n"
+        yield from archive.add_bytes(
+            "README_failed_downloads.txt", readme_content.encode(), zipfile.ZIP_DEFLATED
+        )
     
-    if pdf_content:
-        return filename, pdf_content, None
-    else:
-        zip_url = get_cbse_zip_url(paper.get('year'), paper.get('subject_name'))
-        return filename, None, {
-            'title': paper['title'],
-            'url': zip_url or paper.get('pdf_url', 'N/A')
-        }
+    yield from archive.finish()
+
+def stream_papers_zip(first_results, results, executor, compression=zipfile.ZIP_STORED, bundle=None,
+                      timings=None):
+    """Yield a ZIP archive of the downloaded papers as each one becomes ready
+    
+    If a bundle writer is given the archive is also saved to the bundle cache,
+    but only when it finished streaming with every paper included. Stage
+    timings are logged once the stream ends.
+    """
+    timings = timings or StageTimings()
+    stream_started = time.perf_counter()
+    failed_papers = []
+    completed = False
+    try:
+        for chunk in papers_zip_chunks(itertools.chain(first_results, results), compression, failed_papers):
+            if bundle:
+                bundle.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        results.close()
+        timings.add('stream', time.perf_counter() - stream_started)
+        print(f"Bulk download {'finished' if completed else 'aborted'}: {timings.summary()}")
+        if bundle:
+            if completed and not failed_papers:
+                bundle.commit()
+            else:
+                bundle.abort()
+
+def get_bundle_mode(compression_name, raw_copy):
+    """Describe how a bundle's entries are encoded, for its cache key"""
+    return f"{compression_name}+raw" if raw_copy else compression_name
+
+def send_bundle(bundle_path):
+    """Send a cached bundle with the SHA-256 of its bytes as a strong ETag"""
+    return send_file(
+        bundle_path,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name='cbse_papers.zip',
+        conditional=True,
+        etag=BundleCache.etag_for(bundle_path),
+        max_age=app.config['PDF_MAX_AGE']
+    )
+
+def get_selected_papers(paper_ids):
+    """Look up a selection's papers in one batch, in selection order without repeats"""
+    papers = get_papers_by_ids(paper_ids)
+    selected = dict.fromkeys(int(pid) for pid in paper_ids)
+    return [papers[pid] for pid in selected if pid in papers]
+
+def start_bundle_downloads(papers, order, raw_copy, timings=None):
+    """Start the parallel downloads for a bundle and wait for the first paper
+    
+    Returns the executor, the results seen so far and an iterator over the rest.
+    """
+    # Limit to 5 concurrent archive downloads to avoid overwhelming the server
+    executor = ThreadPoolExecutor(max_workers=5)
+    results = iter_download_results(executor, papers, order, raw_copy, timings)
+    
+    first_results = []
+    with (timings or StageTimings()).stage('first'):
+        for result in results:
+            first_results.append(result)
+            if result[1]:
+                break
+    return executor, first_results, results
+
+def build_bundle(paper_ids, compression_name=None, raw_copy=None):
+    """Build a bulk-download bundle straight into the bundle cache
+    
+    Returns the bundle's key, or None if some papers could not be fetched.
+    """
+    if compression_name is None:
+        compression_name = app.config['BULK_ZIP_COMPRESSION']
+    if raw_copy is None:
+        raw_copy = app.config['BULK_ZIP_RAW_COPY']
+    
+    bundle_key = BundleCache.key_for(paper_ids, get_bundle_mode(compression_name, raw_copy),
+                                     catalog.get().version)
+    if bundle_cache.get(bundle_key):
+        return bundle_key
+    
+    papers = get_selected_papers(sorted(paper_ids))
+    executor, first_results, results = start_bundle_downloads(papers, 'requested', raw_copy)
+    for _ in stream_papers_zip(first_results, results, executor,
+                               ZIP_COMPRESSION_MODES[compression_name],
+                               bundle_cache.writer(bundle_key)):
+        pass
+    return bundle_key if bundle_cache.get(bundle_key) else None
+
+BOOLEAN_STRINGS = {
+    'true': True, '1': True, 'yes': True, 'on': True,
+    'false': False, '0': False, 'no': False, 'off': False,
+}
+
+def parse_bool(value):
+    """Read a JSON flag given as a boolean or a string like "false"; None if it is neither"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return BOOLEAN_STRINGS.get(value.strip().lower())
+    return None
 
 @app.route('/api/download-multiple', methods=['POST'])
 def download_multiple():
-    """Download multiple papers as a ZIP file with actual PDFs using parallel downloads"""
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    
+    """Stream multiple papers as a ZIP file, fetching them in parallel"""
     data = request.get_json()
     paper_ids = data.get('paper_ids', [])
+    # 'requested' keeps the selection order, 'completed' sends whichever paper is ready first
+    order = data.get('order', 'requested')
+    # PDFs are already compressed, so entries are stored unless asked otherwise
+    compression_name = data.get('compression', app.config['BULK_ZIP_COMPRESSION'])
+    raw_copy = parse_bool(data.get('raw_copy', app.config['BULK_ZIP_RAW_COPY']))
     
     if not paper_ids:
         return jsonify({'error': 'No papers selected'}), 400
-    
-    # Create a ZIP file in memory
-    memory_file = io.BytesIO()
-    downloaded_count = 0
-    failed_papers = []
-    results = {}
-    
-    # Use ThreadPoolExecutor for parallel downloads
-    # Limit to 5 concurrent downloads to avoid overwhelming the server
-    max_workers = min(5, len(paper_ids))
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all download tasks
-        future_to_paper = {executor.submit(download_paper_task, pid): pid for pid in paper_ids}
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_paper):
-            paper_id = future_to_paper[future]
-            try:
-                filename, pdf_content, error = future.result()
-                if filename:
-                    results[paper_id] = (filename, pdf_content, error)
-            except Exception as e:
-                print(f"Error downloading paper {paper_id}: {e}")
-    
-    # Create ZIP file with results
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for paper_id in paper_ids:
-            if paper_id in results:
-                filename, pdf_content, error = results[paper_id]
-                if pdf_content:
-                    zf.writestr(filename, pdf_content)
-                    downloaded_count += 1
-                elif error:
-                    failed_papers.append(error)
-        
-        # Add a readme if some downloads failed
-        if failed_papers:
-            readme_content = "Some papers could not be downloaded directly.\n"
-            readme_content += "Please download them manually from the following URLs:\n\n"
-            for fp in failed_papers:
-                readme_content += f"- {fp['title']}\n  URL: {fp['url']}\n\n"
-            zf.writestr("README_failed_downloads.txt", readme_content)
-    
-    memory_file.seek(0)
-    
-    if downloaded_count == 0 and failed_papers:
+    if not isinstance(order, str) or order not in DOWNLOAD_ORDERS:
+        return jsonify({'error': f"Unknown order '{order}'"}), 400
+    if not isinstance(compression_name, str) or compression_name not in ZIP_COMPRESSION_MODES:
+        return jsonify({'error': f"Unknown compression '{compression_name}'"}), 400
+    if raw_copy is None:
+        return jsonify({'error': 'raw_copy must be true or false'}), 400
+    try:
+        bundle_key = BundleCache.key_for(paper_ids, get_bundle_mode(compression_name, raw_copy),
+                                         catalog.get().version)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid paper IDs'}), 400
+    
+    # Popular selections are served from the bundle cache
+    bundle_path = bundle_cache.get(bundle_key)
+    if bundle_path:
+        return send_bundle(bundle_path)
+    
+    # Hold the response until the first paper is ready so a selection where
+    # nothing can be downloaded still gets a JSON error instead of a ZIP
+    timings = StageTimings()
+    with timings.stage('lookup'):
+        papers = get_selected_papers(paper_ids)
+    if not papers:
+        return jsonify({'error': 'Papers not found'}), 404
+    # Only a selection streamed in sorted ID order is saved, so every request
+    # for the key gets its entries in the same order
+    selected_ids = [paper['id'] for paper in papers]
+    canonical = order == 'requested' and selected_ids == sorted(selected_ids)
+    executor, first_results, results = start_bundle_downloads(papers, order, raw_copy, timings)
+    
+    if first_results and not any(source for _, source, _ in first_results):
+        executor.shutdown(wait=False, cancel_futures=True)
+        results.close()
         return jsonify({
             'error': 'Could not download any papers directly',
-            'failed_papers': failed_papers
+            'failed_papers': [error for _, _, error in first_results if error]
         }), 500
     
-    return send_file(
-        memory_file,
+    return Response(
+        stream_papers_zip(first_results, results, executor,
+                          ZIP_COMPRESSION_MODES[compression_name],
+                          bundle_cache.writer(bundle_key) if canonical else None, timings),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='cbse_papers.zip'
+        headers={
+            'Content-Disposition': 'attachment; filename=cbse_papers.zip',
+            # Stages up to the first paper; the full breakdown is logged at the end
+            'Server-Timing': timings.server_timing(),
+        }
     )
 
+@app.route('/api/bundles/<bundle_key>')
+def download_bundle(bundle_key):
+    """Download a cached bundle by key (supports Range and conditional requests)"""
+    if not re.fullmatch(r'[0-9a-f]{64}', bundle_key):
+        return jsonify({'error': 'Bundle not found'}), 404
+    bundle_path = bundle_cache.get(bundle_key)
+    if not bundle_path:
+        return jsonify({'error': 'Bundle not found'}), 404
+    return send_bundle(bundle_path)
+
 @app.route('/api/stats')
 def api_stats():
     """Get statistics about the papers"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Total papers
-    cursor.execute('SELECT COUNT(*) as count FROM papers')
-    total_papers = cursor.fetchone()['count']
-    
-    # Papers by subject
-    cursor.execute('''
-        SELECT s.display_name, COUNT(*) as count 
-        FROM papers p 
-        JOIN subjects s ON p.subject_id = s.id 
-        GROUP BY s.id
-    ''')
-    by_subject = {row['display_name']: row['count'] for row in cursor.fetchall()}
-    
-    # Papers by year
-    cursor.execute('''
-        SELECT y.year, COUNT(*) as count 
-        FROM papers p 
-        JOIN years y ON p.year_id = y.id 
-        GROUP BY y.id
-        ORDER BY y.year DESC
-    ''')
-    by_year = {row['year']: row['count'] for row in cursor.fetchall()}
-    
-    conn.close()
-    
+    # The cache directory's mtime changes whenever a PDF is added or evicted
+    try:
+        cache_mtime = os.stat(app.config['CACHE_DIR']).st_mtime_ns
+    except OSError:
+        cache_mtime = None
+    return catalog_response(
+        ('stats', cache_mtime),
+        lambda snapshot: snapshot.stats(get_cached_paper_ids()),
+    )
+
+CACHED_PAPER_PATTERN = re.compile(r'^paper_(\d+)\.pdf$')
+
+def get_cached_paper_ids():
+    """Get the IDs of papers with an extracted PDF in the cache"""
+    ids = set()
+    for entry in os.scandir(app.config['CACHE_DIR']):
+        match = CACHED_PAPER_PATTERN.match(entry.name)
+        if match:
+            ids.add(int(match.group(1)))
+    return ids
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """Get size, entry and hit/miss/eviction counts for the PDF, ZIP and hot PDF caches"""
     return jsonify({
-        'total_papers': total_papers,
-        'by_subject': by_subject,
-        'by_year': by_year
+        'pdf': pdf_cache.stats(),
+        'zip': zip_cache.stats(),
+        'hot': hot_pdfs.stats() if hot_pdfs else None,
     })
 
 @app.route('/api/search')
 def api_search():
-    """Search papers by title"""
+    """Search papers by subject, year, region, set or title words, or by PDF text"""
     query = request.args.get('q', '')
+    scope = request.args.get('scope', 'title')
+    if scope not in ('title', 'content'):
+        return jsonify({'error': 'scope must be title or content'}), 400
     if not query:
         return jsonify([])
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
-        FROM papers p
-        JOIN subjects s ON p.subject_id = s.id
-        JOIN years y ON p.year_id = y.id
-        JOIN regions r ON p.region_id = r.id
-        WHERE p.title LIKE ?
-        ORDER BY y.year DESC, s.display_name
-        LIMIT 50
-    ''', (f'%{query}%',))
-    papers = cursor.fetchall()
-    conn.close()
-    
-    return jsonify([dict(p) for p in papers])
+    if scope == 'content':
+        return jsonify(search_content(query))
+    return jsonify(search_papers(query))
 
 def initialize_app():
     """Initialize the application"""
     init_db()
     seed_initial_data()
-        add_missing_years()
+    add_missing_years()
+    bundle_cache.clean_stale_temp_files()
+    catalog.get()
 
 if __name__ == '__main__':
     initialize_app()
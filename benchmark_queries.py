@@ -0,0 +1,128 @@
+"""Benchmark the papers filter queries on a synthetic catalog
+
+Builds a throwaway database with --papers synthetic papers, then runs each
+filter shape get_papers produces before and after the composite index
+migration, printing EXPLAIN QUERY PLAN and median latency for both.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import database
+from database import get_db, run_migrations, build_papers_query, MIGRATIONS, migrate_filter_indexes
+
+# Filters the frontend and API clients combine
+FILTER_SHAPES = [
+    ('year', ('year_id',)),
+    ('year+type', ('year_id', 'paper_type')),
+    ('subject', ('subject_id',)),
+    ('subject+year', ('subject_id', 'year_id')),
+    ('region', ('region_id',)),
+    ('region+year', ('region_id', 'year_id')),
+    ('type', ('paper_type',)),
+    ('subject+year+region+type', ('subject_id', 'year_id', 'region_id', 'paper_type')),
+]
+
+def populate_synthetic(conn, total_papers, subjects=40, years=25, regions=4, seed=42):
+    """Fill an empty database with evenly spread synthetic papers"""
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    cursor.executemany('INSERT INTO subjects (name, code, display_name) VALUES (?, ?, ?)',
+                       [(f"subject_{i}", f"{i:03d}", f"Subject {i:02d}") for i in range(subjects)])
+    cursor.executemany('INSERT INTO years (year) VALUES (?)',
+                       [(2000 + i,) for i in range(years)])
+    cursor.executemany('INSERT INTO regions (name, display_name) VALUES (?, ?)',
+                       [(f"region_{i}", f"Region {i}") for i in range(regions)])
+
+    papers = []
+    for n in range(total_papers):
+        paper_type = rng.choice(('question_paper', 'marking_scheme'))
+        papers.append((
+            rng.randint(1, subjects), rng.randint(1, years), rng.randint(1, regions),
+            f"{n}", paper_type, f"Synthetic paper {n}", f"https://example.com/{n}.pdf",
+        ))
+    cursor.executemany('''
+        INSERT INTO papers (subject_id, year_id, region_id, set_code, paper_type, title, pdf_url)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', papers)
+    conn.commit()
+    conn.execute('ANALYZE')
+
+def random_filters(rng, conn, fields):
+    """Pick random values for the given filter fields"""
+    counts = {
+        'subject_id': conn.execute('SELECT COUNT(*) FROM subjects').fetchone()[0],
+        'year_id': conn.execute('SELECT COUNT(*) FROM years').fetchone()[0],
+        'region_id': conn.execute('SELECT COUNT(*) FROM regions').fetchone()[0],
+    }
+    filters = {}
+    for field in fields:
+        if field == 'paper_type':
+            filters[field] = rng.choice(('question_paper', 'marking_scheme'))
+        else:
+            filters[field] = rng.randint(1, counts[field])
+    return filters
+
+def query_plan(conn, fields):
+    """Get EXPLAIN QUERY PLAN lines for a filter shape"""
+    query, params = build_papers_query(**random_filters(random.Random(0), conn, fields))
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+    return [row['detail'] for row in rows]
+
+def time_shape(conn, fields, repeat):
+    """Get the median latency (ms) and average row count of a filter shape"""
+    rng = random.Random(1)
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        query, params = build_papers_query(**random_filters(rng, conn, fields))
+        start = time.perf_counter()
+        rows += len(conn.execute(query, params).fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), rows // repeat
+
+def run_benchmark(conn, repeat):
+    """Measure every filter shape, returning {shape: (median_ms, rows, plan)}"""
+    return {
+        name: time_shape(conn, fields, repeat) + (query_plan(conn, fields),)
+        for name, fields in FILTER_SHAPES
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=100000, help='Synthetic papers to generate')
+    parser.add_argument('--repeat', type=int, default=50, help='Queries per filter shape')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_PATH = os.path.join(tmp, 'benchmark.db')
+        conn = get_db()
+        conn.execute('PRAGMA journal_mode = WAL')
+        run_migrations(conn, target=MIGRATIONS.index(migrate_filter_indexes))
+
+        print(f"Generating {args.papers} synthetic papers...")
+        populate_synthetic(conn, args.papers)
+
+        before = run_benchmark(conn, args.repeat)
+        run_migrations(conn)
+        after = run_benchmark(conn, args.repeat)
+        conn.close()
+
+    print(f"\n{'Filter shape':<28} {'rows':>6} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name, _ in FILTER_SHAPES:
+        before_ms, rows, _ = before[name]
+        after_ms = after[name][0]
+        print(f"{name:<28} {rows:>6} {before_ms:>10.2f} {after_ms:>10.2f} {before_ms / after_ms:>7.1f}x")
+
+    print("\nQuery plans (before -> after):")
+    for name, _ in FILTER_SHAPES:
+        print(f"\n  {name}")
+        for line in before[name][2]:
+            print(f"    before: {line}")
+        for line in after[name][2]:
+            print(f"    after:  {line}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Content-addressed cache of built bulk-download ZIP bundles
+
+A selection is keyed on its sorted paper IDs, the archive mode and the
+catalog version it was built at, so every request for the same selection
+(in any order) finds the same bundle, and a catalog refresh starts new
+bundles. Rebuilding a selection does not reproduce the same bytes (entry
+timestamps and compression depend on when and how the papers were
+fetched), so each bundle file is named after the SHA-256 of its bytes and
+a small ref file points the selection key at it; that digest is the
+bundle's strong ETag. Files live in their own directory, are written
+atomically while being streamed to the first requester, and are evicted
+least-recently-used once the directory grows past its byte budget.
+"""
+import os
+import time
+import hashlib
+import tempfile
+from singleflight import atomic_write_bytes
+
+BUNDLE_SUFFIX = '.zip'
+REF_SUFFIX = '.ref'
+
+class BundleWriter:
+    """Collects a bundle's bytes in a temp file and publishes it on commit"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.cache_dir, prefix=f".{key}.", suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha256.update(data)
+
+    def commit(self):
+        """Publish the finished bundle under its digest, point its key at it and enforce the size budget"""
+        self.file.close()
+        digest = self.sha256.hexdigest()
+        os.replace(self.tmp_path, self.cache.path_for(digest))
+        atomic_write_bytes(self.cache.ref_path(self.key), digest.encode())
+        self.cache.evict()
+
+    def abort(self):
+        """Throw away a partial bundle"""
+        self.file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+class BundleCache:
+    """LRU, size-capped directory of prebuilt bundles"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(paper_ids, mode, version):
+        """Get the cache key for a selection of papers built in a given mode at a catalog version"""
+        ids = ','.join(str(pid) for pid in sorted(set(int(pid) for pid in paper_ids)))
+        return hashlib.sha256(f"{mode}|{version}|{ids}".encode()).hexdigest()
+
+    def path_for(self, digest):
+        """Get the path the bundle with a given SHA-256 is stored under"""
+        return os.path.join(self.cache_dir, digest + BUNDLE_SUFFIX)
+
+    def ref_path(self, key):
+        """Get the path of the file naming the bundle stored for a selection key"""
+        return os.path.join(self.cache_dir, key + REF_SUFFIX)
+
+    @staticmethod
+    def etag_for(path):
+        """Get a stored bundle's strong ETag, the SHA-256 its file is named after"""
+        return os.path.basename(path)[:-len(BUNDLE_SUFFIX)]
+
+    def get(self, key):
+        """Get the path of the bundle stored for a selection key, marking it as recently used"""
+        try:
+            with open(self.ref_path(key)) as f:
+                path = self.path_for(f.read().strip())
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def writer(self, key):
+        """Start writing a new bundle"""
+        return BundleWriter(self, key)
+
+    def evict(self):
+        """Delete least-recently-used bundles until the cache fits its budget"""
+        bundles = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(BUNDLE_SUFFIX) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            bundles.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        bundles.sort()
+        evicted = False
+        for _, size, path in bundles:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                evicted = True
+            except OSError:
+                pass
+        if evicted:
+            self.remove_dangling_refs()
+
+    def remove_dangling_refs(self):
+        """Remove refs whose bundle has been evicted"""
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(REF_SUFFIX):
+                continue
+            try:
+                with open(entry.path) as f:
+                    digest = f.read().strip()
+                if not os.path.exists(self.path_for(digest)):
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def clean_stale_temp_files(self, max_age=3600):
+        """Remove temp files left behind by interrupted builds"""
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.tmp') and entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
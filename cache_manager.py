@@ -0,0 +1,265 @@
+"""Size-bounded LRU bookkeeping for the cache/ and zip_cache/ directories
+
+Each managed directory gets a small SQLite index (.cache_index.db) recording
+every entry's size and last access time, so least-recently-used eviction
+does not depend on filesystem atime (often disabled with noatime) and is
+shared by all gunicorn workers. Entries can be pinned to keep them through
+eviction, or held for as long as a request still has to read them.
+Hit/miss/eviction counters are kept alongside for the stats endpoint.
+Files written by other tools (e.g. the harvester) are picked up by a
+periodic rescan of the directory.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+INDEX_NAME = '.cache_index.db'
+# Entries used this recently are never evicted, so a file is not deleted
+# between being looked up and being sent
+EVICT_MIN_IDLE = 30
+# Holds left behind by a worker that died mid-request lapse after this long
+HOLD_TTL = 3600
+# How often (seconds) eviction rescans the directory for untracked files
+SYNC_INTERVAL = 300
+
+INDEX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS entries (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+    CREATE TABLE IF NOT EXISTS pins (name TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS holds (
+        token TEXT NOT NULL,
+        name TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (token, name)
+    );
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+'''
+
+class CacheManager:
+    """LRU byte budget, pins and counters for one cache directory
+
+    Entries are the files ending in `suffix`; each entry's `companions`
+    (e.g. an archive's index sidecar) count toward its size and are deleted
+    with it.
+    """
+
+    def __init__(self, cache_dir, max_bytes, suffix, companions=(), min_idle=EVICT_MIN_IDLE,
+                 sync_interval=SYNC_INTERVAL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.companions = companions
+        self.min_idle = min_idle
+        self.sync_interval = sync_interval
+        self.last_sync = 0.0
+        self.index_path = os.path.join(cache_dir, INDEX_NAME)
+        self._local = threading.local()
+        self.connect()
+
+    def connect(self):
+        """Get this thread's connection to the directory's index
+
+        The schema is created on every new connection, so the index comes
+        back (empty, to be refilled by sync) if the directory is wiped.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(INDEX_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def entry_size(self, name):
+        """Get the bytes an entry and its companions take on disk, or None if it is gone"""
+        path = os.path.join(self.cache_dir, name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        for companion in self.companions:
+            try:
+                size += os.path.getsize(path + companion)
+            except OSError:
+                pass
+        return size
+
+    def _count(self, conn, name, amount=1):
+        conn.execute('''
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (name, amount))
+
+    def hit(self, path):
+        """Record a cache hit, marking the entry as recently used"""
+        name = os.path.basename(path)
+        with self.connect() as conn:
+            cursor = conn.execute(
+                'UPDATE entries SET last_access = ?, hits = hits + 1 WHERE name = ?',
+                (time.time(), name)
+            )
+            if cursor.rowcount == 0:
+                size = self.entry_size(name)
+                if size is not None:
+                    conn.execute(
+                        'INSERT OR IGNORE INTO entries (name, size, last_access, hits) VALUES (?, ?, ?, 1)',
+                        (name, size, time.time())
+                    )
+            self._count(conn, 'hits')
+
+    def miss(self, count=1):
+        """Record cache misses"""
+        with self.connect() as conn:
+            self._count(conn, 'misses', count)
+
+    def add(self, *paths):
+        """Record newly written entries, then evict down to the byte budget"""
+        now = time.time()
+        with self.connect() as conn:
+            for path in paths:
+                name = os.path.basename(path)
+                size = self.entry_size(name)
+                if size is None:
+                    continue
+                conn.execute('''
+                    INSERT INTO entries (name, size, last_access) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_access = excluded.last_access
+                ''', (name, size, now))
+        self.evict()
+
+    def pin(self, path):
+        """Keep an entry through eviction (it may be pinned before it exists)"""
+        with self.connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO pins (name) VALUES (?)', (os.path.basename(path),))
+
+    def unpin(self, path):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM pins WHERE name = ?', (os.path.basename(path),))
+
+    def hold(self, token, *paths, ttl=HOLD_TTL):
+        """Keep entries through eviction until `token` is released
+
+        Used for files a request has looked up but not yet sent, so a long
+        bulk download does not lose them to another request's eviction.
+        """
+        expires = time.time() + ttl
+        with self.connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO holds (token, name, expires) VALUES (?, ?, ?)',
+                [(token, os.path.basename(path), expires) for path in paths]
+            )
+
+    def release(self, token):
+        """Drop every hold taken with `token`"""
+        with self.connect() as conn:
+            conn.execute('DELETE FROM holds WHERE token = ?', (token,))
+
+    def sync(self):
+        """Reconcile the index with the files actually in the directory"""
+        on_disk = {}
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith('.') or not entry.name.endswith(self.suffix):
+                continue
+            size = self.entry_size(entry.name)
+            if size is not None:
+                on_disk[entry.name] = (size, entry.stat().st_mtime)
+
+        with self.connect() as conn:
+            known = dict(conn.execute('SELECT name, size FROM entries'))
+            conn.executemany('DELETE FROM entries WHERE name = ?',
+                             [(name,) for name in known if name not in on_disk])
+            # Untracked files start out as old as their mtime
+            conn.executemany(
+                'INSERT OR IGNORE INTO entries (name, size, last_access) VALUES (?, ?, ?)',
+                [(name, size, mtime) for name, (size, mtime) in on_disk.items() if name not in known]
+            )
+            conn.executemany(
+                'UPDATE entries SET size = ? WHERE name = ?',
+                [(size, name) for name, (size, _) in on_disk.items()
+                 if name in known and known[name] != size]
+            )
+        self.last_sync = time.time()
+
+    def evict(self):
+        """Delete least-recently-used, unpinned, unheld entries until the directory fits its budget
+
+        Returns the number of entries evicted.
+        """
+        if time.time() - self.last_sync > self.sync_interval:
+            self.sync()
+
+        conn = self.connect()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        evicted = freed = 0
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Re-read under the write lock in case another worker just evicted
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            now = time.time()
+            conn.execute('DELETE FROM holds WHERE expires < ?', (now,))
+            candidates = conn.execute('''
+                SELECT name, size FROM entries
+                WHERE last_access < ? AND name NOT IN (SELECT name FROM pins)
+                AND name NOT IN (SELECT name FROM holds)
+                ORDER BY last_access
+            ''', (now - self.min_idle,)).fetchall()
+            for name, size in candidates:
+                if total <= self.max_bytes:
+                    break
+                path = os.path.join(self.cache_dir, name)
+                for victim in (path,) + tuple(path + companion for companion in self.companions):
+                    try:
+                        os.unlink(victim)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"Could not evict {victim}: {e}")
+                conn.execute('DELETE FROM entries WHERE name = ?', (name,))
+                total -= size
+                freed += size
+                evicted += 1
+            if evicted:
+                self._count(conn, 'evictions', evicted)
+                self._count(conn, 'evicted_bytes', freed)
+        if evicted:
+            print(f"Evicted {evicted} entries ({freed} bytes) from {self.cache_dir}")
+        return evicted
+
+    def stats(self):
+        """Get the directory's size, entry counts and hit/miss/eviction counters"""
+        conn = self.connect()
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        pinned, pinned_size = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(e.size), 0)
+            FROM pins p JOIN entries e ON e.name = p.name
+        ''').fetchone()
+        counters = dict(conn.execute('SELECT name, value FROM counters'))
+        conn.rollback()
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'max_bytes': self.max_bytes,
+            'size_bytes': size,
+            'entries': entries,
+            'pinned_entries': pinned,
+            'pinned_bytes': pinned_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+            'evictions': counters.get('evictions', 0),
+            'evicted_bytes': counters.get('evicted_bytes', 0),
+        }
@@ -0,0 +1,307 @@
+"""In-memory snapshot of the paper catalog
+
+The catalog only changes when the populate/download scripts run, so each
+worker keeps a snapshot of subjects, years, regions and papers in memory
+and serves the listing endpoints from it. Papers are held in the API's sort
+order (year desc, subject, region) with per-dimension position indexes, so
+filtering never touches SQLite. The snapshot is reloaded when the database's
+catalog version (bumped by triggers on every write) changes.
+
+Serialized JSON bodies (and their gzip/brotli encodings) are cached on the
+snapshot per endpoint and filter combination, so they are built at most
+once per catalog version. Only combinations of filter values that exist in
+the catalog are cached, and the cache is bounded by bytes, so arbitrary
+query strings cannot fill it.
+"""
+import gzip
+import json
+import time
+import base64
+import bisect
+import hashlib
+import threading
+from database import get_read_db, get_catalog_version
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+# Upper bound on the bytes of cached bodies (all encodings) per snapshot
+MAX_CACHED_BYTES = 32 * 1024 * 1024
+# Compression levels for bodies compressed on demand in the request thread
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+PAPER_FIELDS = (
+    'id', 'subject_id', 'year_id', 'region_id', 'set_code', 'paper_type', 'title',
+    'pdf_url', 'local_path', 'file_size', 'created_at',
+    'subject_name', 'year', 'region_name',
+)
+
+class Paper:
+    """One paper row with its subject/year/region names"""
+    __slots__ = PAPER_FIELDS
+
+    def __init__(self, row):
+        for field in PAPER_FIELDS:
+            setattr(self, field, row[field])
+
+    def to_dict(self, fields=PAPER_FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+    @property
+    def sort_key(self):
+        """Position in API order: year desc, subject, region, id"""
+        return (-self.year, self.subject_name, self.region_name, self.id)
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor that cannot be decoded"""
+
+def encode_cursor(paper):
+    """Encode the keyset cursor that continues after a paper"""
+    year, subject_name, region_name, paper_id = paper.sort_key
+    data = json.dumps([-year, subject_name, region_name, paper_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a keyset cursor into the sort key it continues after"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        year, subject_name, region_name, paper_id = json.loads(data)
+        return (-int(year), str(subject_name), str(region_name), int(paper_id))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+class CachedBody:
+    """A serialized JSON body and its compressed encodings"""
+    __slots__ = ('identity', 'encodings')
+
+    def __init__(self, data):
+        self.identity = data
+        self.encodings = {}
+
+    @property
+    def size(self):
+        return len(self.identity) + sum(len(data) for data in self.encodings.values())
+
+    def encoded(self, encoding):
+        """Get the body in an encoding ('gzip', 'br' or None), compressing it once"""
+        if encoding is None or len(self.identity) < MIN_COMPRESS_SIZE:
+            return None, self.identity
+        data = self.encodings.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(self.identity, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.identity, compresslevel=GZIP_LEVEL, mtime=0)
+            self.encodings[encoding] = data
+        return encoding, data
+
+class CatalogSnapshot:
+    """Immutable catalog contents at one catalog version"""
+
+    def __init__(self, version, subjects, years, regions, papers, stats_rows=()):
+        self.version = version
+        self.stats_rows = stats_rows
+        self.subjects = subjects
+        self.years = years
+        self.regions = regions
+        self.papers = papers
+        self.by_id = {paper.id: paper for paper in papers}
+        self.bodies = {}
+        self.bodies_bytes = 0
+        self.bodies_lock = threading.Lock()
+
+        # Positions into self.papers for each filter value, in sort order
+        self.indexes = {field: {} for field in ('subject_id', 'year_id', 'region_id', 'paper_type')}
+        for position, paper in enumerate(papers):
+            for field, index in self.indexes.items():
+                index.setdefault(getattr(paper, field), []).append(position)
+
+        self.sort_keys = [paper.sort_key for paper in papers]
+
+    def filter(self, subject_id=None, year_id=None, region_id=None, paper_type=None):
+        """Get papers matching the filters, in API order"""
+        return [self.papers[position]
+                for position in self.filter_positions(subject_id, year_id, region_id, paper_type)]
+
+    def has_filter_values(self, subject_id=None, year_id=None, region_id=None, paper_type=None):
+        """Check that every given filter value occurs in the catalog"""
+        return all(
+            not value or value in self.indexes[field]
+            for field, value in (
+                ('subject_id', subject_id), ('year_id', year_id),
+                ('region_id', region_id), ('paper_type', paper_type),
+            )
+        )
+
+    def filter_positions(self, subject_id=None, year_id=None, region_id=None, paper_type=None):
+        """Get the sorted positions (into self.papers) of papers matching the filters"""
+        filters = [
+            (field, value) for field, value in (
+                ('subject_id', subject_id), ('year_id', year_id),
+                ('region_id', region_id), ('paper_type', paper_type),
+            ) if value
+        ]
+        if not filters:
+            return range(len(self.papers))
+
+        # Walk the most selective index and check the remaining filters
+        postings = [self.indexes[field].get(value, []) for field, value in filters]
+        smallest = min(postings, key=len)
+        if len(filters) == 1:
+            return smallest
+        return [
+            position for position in smallest
+            if all(getattr(self.papers[position], field) == value for field, value in filters)
+        ]
+
+    def page(self, positions, after=None, limit=None):
+        """Get up to `limit` papers from `positions` that sort after the `after` key
+
+        Keyset pagination: the cursor is a sort key rather than an offset, so
+        pages stay consistent when papers are added or removed in between.
+        Returns (papers, last_paper_or_None_when_there_are_no_more).
+        """
+        start = 0
+        if after is not None:
+            # First global position past the cursor, then the first match at or after it
+            global_start = bisect.bisect_right(self.sort_keys, after)
+            start = bisect.bisect_left(positions, global_start)
+        end = len(positions) if limit is None else start + limit
+        papers = [self.papers[position] for position in positions[start:end]]
+        has_more = end < len(positions)
+        return papers, (papers[-1] if has_more and papers else None)
+
+    def etag_for(self, key):
+        """Get a strong ETag for a cached body, derived from the catalog version"""
+        digest = hashlib.md5(repr(key).encode()).hexdigest()[:16]
+        return f"{self.version}-{digest}"
+
+    def encoded_body(self, key, build, encoding, cacheable=True):
+        """Get the body for key in an encoding, as (encoding, data)
+
+        build() serializes the body on a miss. With `cacheable` the body and
+        its encodings are kept, evicting the oldest bodies beyond
+        MAX_CACHED_BYTES.
+        """
+        body = self.bodies.get(key)
+        if body is None:
+            body = CachedBody(build())
+            if not cacheable:
+                return body.encoded(encoding)
+        before = body.size
+        encoding, data = body.encoded(encoding)
+
+        with self.bodies_lock:
+            if self.bodies.get(key) is body:
+                self.bodies_bytes += body.size - before
+            elif cacheable and key not in self.bodies:
+                self.bodies[key] = body
+                self.bodies_bytes += body.size
+            while self.bodies_bytes > MAX_CACHED_BYTES and self.bodies:
+                oldest = next(iter(self.bodies))
+                self.bodies_bytes -= self.bodies.pop(oldest).size
+        return encoding, data
+
+    def stats(self, cached_ids=frozenset()):
+        """Summarize the catalog from the materialized paper_stats rows
+
+        `cached_ids` are the papers with an extracted PDF in cache/; with the
+        papers that have a local PDF they make up the available papers.
+        """
+        subject_names = {s['id']: s['display_name'] for s in self.subjects}
+        year_values = {y['id']: y['year'] for y in self.years}
+        region_names = {r['id']: r['display_name'] for r in self.regions}
+
+        by_subject, by_year, by_region, by_paper_type = {}, {}, {}, {}
+        subject_year = {}
+        total = local = 0
+        for row in self.stats_rows:
+            count = row['papers']
+            subject = subject_names.get(row['subject_id'])
+            year = year_values.get(row['year_id'])
+            region = region_names.get(row['region_id'])
+            total += count
+            local += row['local_papers']
+            by_subject[subject] = by_subject.get(subject, 0) + count
+            by_year[year] = by_year.get(year, 0) + count
+            by_region[region] = by_region.get(region, 0) + count
+            by_paper_type[row['paper_type']] = by_paper_type.get(row['paper_type'], 0) + count
+            matrix_row = subject_year.setdefault(subject, {})
+            matrix_row[year] = matrix_row.get(year, 0) + count
+
+        cached = available = 0
+        available_by_subject = {}
+        for paper in self.papers:
+            is_cached = paper.id in cached_ids
+            cached += is_cached
+            if is_cached or paper.local_path:
+                available += 1
+                available_by_subject[paper.subject_name] = available_by_subject.get(paper.subject_name, 0) + 1
+
+        return {
+            'total_papers': total,
+            'by_subject': by_subject,
+            'by_year': by_year,
+            'by_region': by_region,
+            'by_paper_type': by_paper_type,
+            'subject_year': subject_year,
+            'local_papers': local,
+            'cached_papers': cached,
+            'available_papers': available,
+            'available_by_subject': available_by_subject,
+        }
+
+def load_catalog_snapshot(conn=None):
+    """Read the whole catalog from SQLite"""
+    conn = conn or get_read_db()
+    cursor = conn.cursor()
+
+    version = get_catalog_version(conn)
+    cursor.execute('SELECT * FROM subjects ORDER BY display_name')
+    subjects = [dict(s) for s in cursor.fetchall()]
+    cursor.execute('SELECT * FROM years ORDER BY year DESC')
+    years = [dict(y) for y in cursor.fetchall()]
+    cursor.execute('SELECT * FROM regions ORDER BY display_name')
+    regions = [dict(r) for r in cursor.fetchall()]
+    cursor.execute('SELECT * FROM paper_stats WHERE papers > 0')
+    stats_rows = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('''
+        SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        JOIN regions r ON p.region_id = r.id
+        ORDER BY y.year DESC, s.display_name, r.display_name, p.id
+    ''')
+    # Sorted in Python too, so keyset cursors compare exactly as the list is ordered
+    papers = tuple(sorted((Paper(row) for row in cursor.fetchall()), key=lambda p: p.sort_key))
+    return CatalogSnapshot(version, subjects, years, regions, papers, stats_rows)
+
+class Catalog:
+    """Process-wide catalog cache that reloads when the catalog version changes"""
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Get the current snapshot, checking the catalog version at most every check_interval"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self.check_interval:
+                return self._snapshot
+            if self._snapshot is None or get_catalog_version() != self._snapshot.version:
+                self._snapshot = load_catalog_snapshot()
+            self._checked_at = time.monotonic()
+            return self._snapshot
@@ -1,20 +1,80 @@
 """Database setup and models for CBSE Papers Archive"""
 import sqlite3
 import os
+import threading
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'cbse_papers.db')
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Per-connection tuning; WAL itself is persistent and set once in init_db
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',      # 16 MB page cache
+    'PRAGMA mmap_size = 268435456',    # map up to 256 MB of the file
+    'PRAGMA temp_store = MEMORY',
+)
+# Prepared statements kept per connection (sqlite3 caches them by SQL text)
+STATEMENT_CACHE_SIZE = 256
+
+_thread_state = threading.local()
+
+def configure_connection(conn):
+    """Apply row factory and performance pragmas to a new connection"""
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db():
+    """Get a new read-write database connection (the caller closes it)"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=5, cached_statements=STATEMENT_CACHE_SIZE)
+    return configure_connection(conn)
+
+def get_read_db():
+    """Get this thread's shared read-only connection
+    
+    The connection stays open for the life of the thread so its prepared
+    statements and page cache are reused across requests; callers must not
+    close it. In WAL mode these readers never block, or wait on, writers.
+    """
+    conn = getattr(_thread_state, 'read_conn', None)
+    if conn is not None and _thread_state.read_path == DATABASE_PATH:
+        return conn
+    close_read_db()
+    
+    conn = sqlite3.connect(
+        f"file:{DATABASE_PATH}?mode=ro", uri=True, timeout=5,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    configure_connection(conn)
+    _thread_state.read_conn = conn
+    _thread_state.read_path = DATABASE_PATH
     return conn
 
+def release_read_db():
+    """End any transaction left open on this thread's read connection (request teardown)"""
+    conn = getattr(_thread_state, 'read_conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+def close_read_db():
+    """Close this thread's read connection"""
+    conn = getattr(_thread_state, 'read_conn', None)
+    if conn is not None:
+        conn.close()
+        _thread_state.read_conn = None
+
 def init_db():
     """Initialize the database with schema"""
     conn = get_db()
-    cursor = conn.cursor()
     
+    # Readers and the writer scripts work concurrently under WAL
+    conn.execute('PRAGMA journal_mode = WAL')
+    run_migrations(conn)
+    conn.close()
+
+def migrate_base_schema(cursor):
+    """Create the catalog tables and their single-column indexes"""
     # Create subjects table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS subjects (
@@ -66,9 +126,283 @@ def init_db():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_papers_subject ON papers(subject_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_papers_year ON papers(year_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_papers_region ON papers(region_id)')
+
+def migrate_natural_key(cursor):
+    """One row per subject/year/region/set/type, so populate can upsert"""
+    remove_duplicate_papers(cursor)
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_papers_natural_key
+        ON papers(subject_id, year_id, region_id, set_code, paper_type)
+    ''')
+
+def migrate_filter_indexes(cursor):
+    """Replace the single-column indexes with composites matching get_papers' filters
     
-    conn.commit()
-    conn.close()
+    Subject-first filters already use the natural key index; these cover the
+    shapes that start from year, region or paper type. The old single-column
+    indexes are prefixes of these and only cost writes.
+    """
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_papers_year_subject_region
+        ON papers(year_id, subject_id, region_id, paper_type)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_papers_region_year
+        ON papers(region_id, year_id, paper_type)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_papers_type_year
+        ON papers(paper_type, year_id, subject_id)
+    ''')
+    for index in ('idx_papers_subject', 'idx_papers_year', 'idx_papers_region'):
+        cursor.execute(f'DROP INDEX IF EXISTS {index}')
+    cursor.execute('ANALYZE')
+
+def migrate_catalog_version(cursor):
+    create_catalog_version(cursor)
+
+def migrate_search_index(cursor):
+    create_search_index(cursor)
+
+def migrate_content_index(cursor):
+    """Create the page-level full-text index of PDF contents (see index_pdf_content.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paper_texts (
+            paper_id INTEGER PRIMARY KEY,
+            file_hash TEXT NOT NULL,
+            file_size INTEGER,
+            file_mtime REAL,
+            page_count INTEGER,
+            indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (paper_id) REFERENCES papers(id)
+        )
+    ''')
+    if not fts5_available(cursor):
+        return
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS paper_pages_fts USING fts5(
+            content, paper_id UNINDEXED, page UNINDEXED,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+
+def migrate_paper_stats(cursor):
+    """Create the paper_stats summary and the triggers that maintain it
+    
+    One row per subject/year/region/type with its paper count and how many
+    of those papers have a local PDF, so stats never scan papers.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paper_stats (
+            subject_id INTEGER NOT NULL,
+            year_id INTEGER NOT NULL,
+            region_id INTEGER NOT NULL,
+            paper_type TEXT NOT NULL,
+            papers INTEGER NOT NULL DEFAULT 0,
+            local_papers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (subject_id, year_id, region_id, paper_type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM paper_stats')
+    cursor.execute('''
+        INSERT INTO paper_stats (subject_id, year_id, region_id, paper_type, papers, local_papers)
+        SELECT subject_id, year_id, region_id, IFNULL(paper_type, ''), COUNT(*),
+               COUNT(local_path)
+        FROM papers
+        GROUP BY subject_id, year_id, region_id, IFNULL(paper_type, '')
+    ''')
+    
+    add_row = '''
+        INSERT INTO paper_stats (subject_id, year_id, region_id, paper_type, papers, local_papers)
+        VALUES (new.subject_id, new.year_id, new.region_id, IFNULL(new.paper_type, ''),
+                1, new.local_path IS NOT NULL)
+        ON CONFLICT (subject_id, year_id, region_id, paper_type) DO UPDATE SET
+            papers = papers + 1,
+            local_papers = local_papers + (new.local_path IS NOT NULL);
+    '''
+    remove_row = '''
+        UPDATE paper_stats SET
+            papers = papers - 1,
+            local_papers = local_papers - (old.local_path IS NOT NULL)
+        WHERE subject_id = old.subject_id AND year_id = old.year_id
+          AND region_id = old.region_id AND paper_type = IFNULL(old.paper_type, '');
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_stats_insert AFTER INSERT ON papers
+        BEGIN {add_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_stats_update
+        AFTER UPDATE OF subject_id, year_id, region_id, paper_type, local_path ON papers
+        BEGIN {remove_row} {add_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_stats_delete AFTER DELETE ON papers
+        BEGIN {remove_row} END
+    ''')
+
+def migrate_page_rowids(cursor):
+    """Record each paper's paper_pages_fts rowids so its pages are deleted by rowid"""
+    cursor.execute('ALTER TABLE paper_texts ADD COLUMN page_rowids TEXT')
+
+# Schema migrations in order; PRAGMA user_version records how many have run.
+# Append new ones at the end and never reorder or edit applied ones.
+MIGRATIONS = [
+    migrate_base_schema,
+    migrate_natural_key,
+    migrate_catalog_version,
+    migrate_filter_indexes,
+    migrate_search_index,
+    migrate_content_index,
+    migrate_paper_stats,
+    migrate_page_rowids,
+]
+
+def get_schema_version(conn):
+    """Get the number of migrations applied to a database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn, target=None):
+    """Apply pending migrations (up to `target`), each in its own transaction
+    
+    Databases created before versioning report version 0; the early
+    migrations are idempotent so they simply re-check what already exists.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    version = get_schema_version(conn)
+    cursor = conn.cursor()
+    for number in range(version + 1, target + 1):
+        cursor.execute('BEGIN')
+        MIGRATIONS[number - 1](cursor)
+        cursor.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+    return max(version, target)
+
+CATALOG_TABLES = ('papers', 'subjects', 'years', 'regions')
+
+def create_catalog_version(cursor):
+    """Create the catalog version counter and the triggers that bump it
+    
+    Any insert, update or delete on the catalog tables increments
+    catalog_meta.version, so in-process caches know when to reload.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 1)')
+    
+    for table in CATALOG_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+def get_catalog_version(conn=None):
+    """Get the current catalog version"""
+    conn = conn or get_read_db()
+    row = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()
+    return row['version'] if row else 0
+
+# Searchable text for each paper, keyed by paper id (the FTS rowid)
+SEARCH_ROWS_SQL = '''
+    SELECT p.id, p.title, s.display_name || ' ' || IFNULL(s.code, ''),
+           r.display_name, y.year, p.set_code, REPLACE(p.paper_type, '_', ' ')
+    FROM papers p
+    JOIN subjects s ON p.subject_id = s.id
+    JOIN years y ON p.year_id = y.id
+    JOIN regions r ON p.region_id = r.id
+'''
+SEARCH_INSERT_SQL = '''
+    INSERT INTO papers_fts (rowid, title, subject, region, year, set_code, paper_type)
+''' + SEARCH_ROWS_SQL
+
+def fts5_available(cursor):
+    """Check whether this SQLite build includes FTS5"""
+    cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+    if cursor.fetchone()[0]:
+        return True
+    try:
+        cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)')
+        cursor.execute('DROP TABLE temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def create_search_index(cursor):
+    """Create the papers_fts full-text index and the triggers that keep it in sync
+    
+    Each row holds a paper's title with its subject (name and code), region,
+    year, set and type, so free-text queries match any of them. Skipped when
+    SQLite lacks FTS5; search then falls back to LIKE.
+    """
+    if not fts5_available(cursor):
+        print("SQLite has no FTS5 support; search will use LIKE")
+        return
+    
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+            title, subject, region, year, set_code, paper_type,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    cursor.execute('DELETE FROM papers_fts')
+    cursor.execute(SEARCH_INSERT_SQL)
+    
+    # Papers: reindex the row itself
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_fts_insert AFTER INSERT ON papers
+        BEGIN
+            {SEARCH_INSERT_SQL} WHERE p.id = new.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_fts_update AFTER UPDATE ON papers
+        BEGIN
+            DELETE FROM papers_fts WHERE rowid = old.id;
+            {SEARCH_INSERT_SQL} WHERE p.id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_papers_fts_delete AFTER DELETE ON papers
+        BEGIN
+            DELETE FROM papers_fts WHERE rowid = old.id;
+        END
+    ''')
+    
+    # Dimensions: reindex every paper that shows the renamed value
+    for table, column in (('subjects', 'subject_id'), ('years', 'year_id'), ('regions', 'region_id')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE ON {table}
+            BEGIN
+                DELETE FROM papers_fts WHERE rowid IN (SELECT id FROM papers WHERE {column} = new.id);
+                {SEARCH_INSERT_SQL} WHERE p.{column} = new.id;
+            END
+        ''')
+
+def has_search_index(conn, name='papers_fts'):
+    """Check whether a full-text index (papers_fts or paper_pages_fts) exists"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+def remove_duplicate_papers(cursor):
+    """Delete repeated papers left by earlier non-idempotent populate runs, keeping the oldest"""
+    cursor.execute('''
+        DELETE FROM papers WHERE id NOT IN (
+            SELECT MIN(id) FROM papers
+            GROUP BY subject_id, year_id, region_id, set_code, paper_type
+        )
+    ''')
+    return cursor.rowcount
 
 def seed_initial_data():
     """Seed initial data for subjects, years, and regions"""
@@ -114,36 +448,30 @@ def seed_initial_data():
 
 def get_all_subjects():
     """Get all subjects"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM subjects ORDER BY display_name')
     subjects = cursor.fetchall()
-    conn.close()
     return [dict(s) for s in subjects]
 
 def get_all_years():
     """Get all years"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM years ORDER BY year DESC')
     years = cursor.fetchall()
-    conn.close()
     return [dict(y) for y in years]
 
 def get_all_regions():
     """Get all regions"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM regions ORDER BY display_name')
     regions = cursor.fetchall()
-    conn.close()
     return [dict(r) for r in regions]
 
-def get_papers(subject_id=None, year_id=None, region_id=None, paper_type=None):
-    """Get papers with optional filters"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
+def build_papers_query(subject_id=None, year_id=None, region_id=None, paper_type=None):
+    """Build the SQL and parameters for get_papers' filters"""
     query = '''
         SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
         FROM papers p
@@ -167,16 +495,22 @@ def get_papers(subject_id=None, year_id=None, region_id=None, paper_type=None):
         query += ' AND p.paper_type = ?'
         params.append(paper_type)
     
-    query += ' ORDER BY y.year DESC, s.display_name, r.display_name'
+    query += ' ORDER BY y.year DESC, s.display_name, r.display_name, p.id'
+    return query, params
+
+def get_papers(subject_id=None, year_id=None, region_id=None, paper_type=None):
+    """Get papers with optional filters"""
+    conn = get_read_db()
+    cursor = conn.cursor()
     
+    query, params = build_papers_query(subject_id, year_id, region_id, paper_type)
     cursor.execute(query, params)
     papers = cursor.fetchall()
-    conn.close()
     return [dict(p) for p in papers]
 
 def get_paper_by_id(paper_id):
     """Get a single paper by ID"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
@@ -187,9 +521,33 @@ def get_paper_by_id(paper_id):
         WHERE p.id = ?
     ''', (paper_id,))
     paper = cursor.fetchone()
-    conn.close()
     return dict(paper) if paper else None
 
+# Stay well under SQLite's bound-parameter limit (999 on older builds)
+ID_CHUNK_SIZE = 500
+
+def get_papers_by_ids(paper_ids):
+    """Get several papers by ID in a few queries, as a dict keyed by ID"""
+    conn = get_read_db()
+    cursor = conn.cursor()
+    ids = list(dict.fromkeys(int(pid) for pid in paper_ids))
+    
+    papers = {}
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
+            FROM papers p
+            JOIN subjects s ON p.subject_id = s.id
+            JOIN years y ON p.year_id = y.id
+            JOIN regions r ON p.region_id = r.id
+            WHERE p.id IN ({placeholders})
+        ''', chunk)
+        for row in cursor.fetchall():
+            papers[row['id']] = dict(row)
+    return papers
+
 def add_paper(subject_id, year_id, region_id, set_code, paper_type, title, pdf_url=None, local_path=None):
     """Add a new paper to the database"""
     conn = get_db()
@@ -203,52 +561,85 @@ def add_paper(subject_id, year_id, region_id, set_code, paper_type, title, pdf_u
     conn.close()
     return paper_id
 
+def bulk_upsert_papers(papers):
+    """Insert or update many papers in one transaction
+    
+    Each paper is a dict with subject_id, year_id, region_id, set_code,
+    paper_type, title and pdf_url. Rows are matched on the natural key
+    (subject/year/region/set/type), so re-running is idempotent; an existing
+    row keeps its id and local_path and gets the new title and pdf_url.
+    Rows whose title and pdf_url are unchanged are not written, so a no-op
+    run fires no triggers and leaves the catalog version alone. Returns the
+    number of rows inserted or changed.
+    """
+    conn = get_db()
+    with conn:
+        cursor = conn.executemany('''
+            INSERT INTO papers (subject_id, year_id, region_id, set_code, paper_type, title, pdf_url)
+            VALUES (:subject_id, :year_id, :region_id, :set_code, :paper_type, :title, :pdf_url)
+            ON CONFLICT(subject_id, year_id, region_id, set_code, paper_type)
+            DO UPDATE SET title = excluded.title, pdf_url = excluded.pdf_url
+            WHERE title IS NOT excluded.title OR pdf_url IS NOT excluded.pdf_url
+        ''', papers)
+    conn.close()
+    return cursor.rowcount
+
+def get_dimension_ids():
+    """Get name -> id maps for subjects, regions and year value -> id for years"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name FROM subjects')
+    subjects = {row['name']: row['id'] for row in cursor.fetchall()}
+    cursor.execute('SELECT id, year FROM years')
+    years = {row['year']: row['id'] for row in cursor.fetchall()}
+    cursor.execute('SELECT id, name FROM regions')
+    regions = {row['name']: row['id'] for row in cursor.fetchall()}
+    conn.close()
+    return subjects, years, regions
+
 def get_subject_by_name(name):
     """Get subject by name"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM subjects WHERE name = ?', (name,))
     subject = cursor.fetchone()
-    conn.close()
     return dict(subject) if subject else None
 
 def get_year_by_value(year):
     """Get year by value"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM years WHERE year = ?', (year,))
     year_row = cursor.fetchone()
-    conn.close()
     return dict(year_row) if year_row else None
 
 def get_region_by_name(name):
     """Get region by name"""
-    conn = get_db()
+    conn = get_read_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM regions WHERE name = ?', (name,))
     region = cursor.fetchone()
-    conn.close()
     return dict(region) if region else None
 
 def add_missing_years():
- """Add any missing years to the database"""
- conn = get_db()
- cursor = conn.cursor()
- 
- # Check which years exist
- cursor.execute('SELECT year FROM years ORDER BY year')
- existing_years = set(row['year'] for row in cursor.fetchall())
- 
- # Add missing years
- for year in range(2015, 2026):  # 2015-2025
- if year not in existing_years:
- cursor.execute('INSERT INTO years (year) VALUES (?)', (year,))
- 
- conn.commit()
- conn.close()
+    """Add any missing years to the database"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Check which years exist
+    cursor.execute('SELECT year FROM years ORDER BY year')
+    existing_years = set(row['year'] for row in cursor.fetchall())
+    
+    # Add missing years
+    for year in range(2015, 2026):  # 2015-2025
+        if year not in existing_years:
+            cursor.execute('INSERT INTO years (year) VALUES (?)', (year,))
+    
+    conn.commit()
+    conn.close()
 
 if __name__ == '__main__':
     init_db()
     seed_initial_data()
-        add_missing_years()
+    add_missing_years()
     print("Database initialized and seeded successfully!")
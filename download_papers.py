@@ -1,18 +1,27 @@
 """Script to download CBSE papers from official sources and store locally"""
 import os
-import io
-import zipfile
-import requests
-import time
 import re
-from database import get_db, init_db, seed_initial_data
+import json
+import time
+import zlib
+import hashlib
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from database import get_db
+from fetch import fetcher, load_validators, VALIDATORS_SUFFIX
+from paper_urls import parse_paper_filename, paper_code_sort_key
+from singleflight import single_flight, atomic_writer
+from zip_index import zip_cache_path, build_zip_index, INDEX_SUFFIX
+from preextract import PreExtractor
+from paper_files import CACHE_DIR
 
 # Configuration
 PAPERS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'papers')
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept': '*/*',
-}
+ZIP_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'zip_cache')
+LOCK_DIR = os.path.join(os.path.dirname(__file__), '.locks')
+MANIFEST_PATH = os.path.join(ZIP_CACHE_DIR, 'harvest_manifest.json')
+COPY_CHUNK_SIZE = 256 * 1024
 
 # CBSE Official ZIP URLs
 CBSE_URLS = {
@@ -80,112 +89,318 @@ SUBJECT_DISPLAY = {
 def ensure_dirs():
     """Ensure required directories exist"""
     os.makedirs(PAPERS_DIR, exist_ok=True)
+    os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
     for year in range(2015, 2026):
         year_dir = os.path.join(PAPERS_DIR, str(year))
         os.makedirs(year_dir, exist_ok=True)
 
-def download_and_extract_zip(url, year, subject):
-    """Download a ZIP file and extract PDFs"""
-    print(f"Downloading {subject} {year} from {url}")
+def fetch_archive(url):
+    """Download an archive into zip_cache/ unless the cached copy is still current
+    
+    Returns the archive path and the fetch result (status 304 when unchanged).
+    An archive that cannot be indexed is removed along with its validators,
+    so the next run downloads it again instead of being told it is unchanged.
+    """
+    # Ask for the archive only if it changed since the cached copy was fetched
+    zip_path = zip_cache_path(url, ZIP_CACHE_DIR)
+    validators = load_validators(zip_path) if os.path.exists(zip_path) else None
+    
+    with single_flight(zip_path, LOCK_DIR):
+        result = fetcher.download_to_file(url, zip_path, validators=validators)
+        if result['status'] != 304:
+            try:
+                build_zip_index(zip_path)
+            except zipfile.BadZipFile:
+                for path in (zip_path, zip_path + INDEX_SUFFIX, zip_path + VALIDATORS_SUFFIX):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                raise
+    return zip_path, result
+
+def file_checksums(path):
+    """Get the CRC32 and sha256 of a file on disk"""
+    crc = 0
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            sha.update(chunk)
+    return crc, sha.hexdigest()
+
+def sync_archive(zip_path, year, subject, previous_files=None, papers_dir=None):
+    """Bring papers_dir/<year>/ in line with an archive, writing only changed PDFs
+    
+    A PDF is rewritten only when its CRC32 in the archive's central directory
+    differs from the one recorded for the file on disk. Files this archive
+    produced before but no longer contains are deleted. Runs in a worker
+    process during a harvest, so it only takes plain arguments.
+    
+    Returns the per-file records ({path: {member, size, crc32, sha256}}) and
+    a report listing added, updated, unchanged and removed paths.
+    """
+    papers_dir = papers_dir or PAPERS_DIR
+    previous_files = previous_files or {}
+    files = {}
+    report = {'added': [], 'updated': [], 'unchanged': [], 'removed': []}
     
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        for file_info in zf.filelist:
+            if not file_info.filename.lower().endswith('.pdf'):
+                continue
+            
+            # Generate clean filename
+            original_name = os.path.basename(file_info.filename)
+            clean_name = f"{subject}_{year}_{original_name}"
+            clean_name = re.sub(r'[^\w\-_\.]', '_', clean_name)
+            save_path = os.path.join(papers_dir, str(year), clean_name)
+            
+            existed = os.path.exists(save_path)
+            if existed and os.path.getsize(save_path) == file_info.file_size:
+                record = previous_files.get(save_path)
+                if not record:
+                    # First sync of a file extracted before the manifest existed
+                    crc, sha256 = file_checksums(save_path)
+                    record = {'member': file_info.filename, 'size': file_info.file_size,
+                              'crc32': crc, 'sha256': sha256}
+                if record['crc32'] == file_info.CRC:
+                    files[save_path] = record
+                    report['unchanged'].append(save_path)
+                    continue
+            
+            # Save to papers directory
+            sha = hashlib.sha256()
+            with zf.open(file_info) as src, atomic_writer(save_path) as dest:
+                for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    dest.write(chunk)
+            files[save_path] = {'member': file_info.filename, 'size': file_info.file_size,
+                                'crc32': file_info.CRC, 'sha256': sha.hexdigest()}
+            report['updated' if existed else 'added'].append(save_path)
+    
+    # Remove files this archive no longer provides
+    for path in previous_files:
+        if path not in files:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            report['removed'].append(path)
+    
+    return files, report
+
+def format_sync_report(report):
+    """Summarise a sync report in one line"""
+    return ', '.join(f"{len(report[key])} {key}" for key in ('added', 'updated', 'unchanged', 'removed'))
+
+def load_manifest():
+    """Load the harvest manifest recording what each archive produced"""
     try:
-        response = requests.get(url, headers=HEADERS, timeout=120, stream=True)
-        if response.status_code != 200:
-            print(f"  Failed to download: HTTP {response.status_code}")
-            return []
-        
-        # Extract ZIP contents
-        zip_content = io.BytesIO(response.content)
-        extracted_files = []
-        
-        with zipfile.ZipFile(zip_content, 'r') as zf:
-            for file_info in zf.filelist:
-                if file_info.filename.lower().endswith('.pdf'):
-                    # Extract PDF
-                    pdf_content = zf.read(file_info.filename)
-                    
-                    # Generate clean filename
-                    original_name = os.path.basename(file_info.filename)
-                    clean_name = f"{subject}_{year}_{original_name}"
-                    clean_name = re.sub(r'[^\w\-_\.]', '_', clean_name)
-                    
-                    # Save to papers directory
-                    save_path = os.path.join(PAPERS_DIR, str(year), clean_name)
-                    with open(save_path, 'wb') as f:
-                        f.write(pdf_content)
-                    
-                    extracted_files.append({
-                        'original_name': original_name,
-                        'saved_path': save_path,
-                        'size': len(pdf_content)
-                    })
-                    print(f"  Extracted: {clean_name} ({len(pdf_content)} bytes)")
-        
-        return extracted_files
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    """Atomically write the harvest manifest"""
+    with atomic_writer(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def get_manifest_files(manifest, url):
+    """Get the per-file records an archive produced on its last sync"""
+    files = manifest.get(url, {}).get('files')
+    # Manifests from before per-file records only listed paths
+    return files if isinstance(files, dict) else {}
+
+def make_manifest_entry(url, year, subject, files):
+    """Build the manifest entry for a synced archive"""
+    zip_path = zip_cache_path(url, ZIP_CACHE_DIR)
+    return {
+        'year': year,
+        'subject': subject,
+        'sha256': load_validators(zip_path).get('sha256'),
+        'files': files,
+        'harvested_at': time.time(),
+    }
+
+def is_harvested(manifest, url, zip_path):
+    """Check whether an unchanged archive was already fully extracted"""
+    entry = manifest.get(url)
+    if not entry:
+        return False
+    if entry.get('sha256') != load_validators(zip_path).get('sha256'):
+        return False
+    return all(os.path.exists(path) for path in entry.get('files', []))
+
+def index_local_files(years):
+    """List each year directory once and index its PDFs by what their names describe
+    
+    Returns {(subject, year, set_num, paper_type): [(region, path, size), ...]}
+    with each list sorted so the lowest paper series comes first, numerically
+    and in the same order find_member uses for cached archives.
+    """
+    index = {}
+    sort_keys = {}
+    for year in years:
+        year_dir = os.path.join(PAPERS_DIR, str(year))
+        if not os.path.isdir(year_dir):
+            continue
         
-    except Exception as e:
-        print(f"  Error: {e}")
-        return []
+        for entry in os.scandir(year_dir):
+            if not entry.name.lower().endswith('.pdf') or not entry.is_file():
+                continue
+            info = parse_paper_filename(entry.name)
+            if not info['subject']:
+                continue
+            key = (info['subject'], info['year'] or year, info['set_num'] or '1', info['paper_type'])
+            index.setdefault(key, []).append((info['region'], entry.path, entry.stat().st_size))
+            sort_keys[entry.path] = paper_code_sort_key(info['paper_code'], entry.name)
+    
+    for files in index.values():
+        files.sort(key=lambda f: sort_keys[f[1]])
+    return index
+
+def match_local_file(index, subject, year, region, set_code, paper_type):
+    """Pick the local file for a paper: same region if named, else a region-less file"""
+    set_num = set_code.replace('Set ', '') if set_code else '1'
+    files = index.get((subject, year, set_num, paper_type), [])
+    for file_region, path, size in files:
+        if file_region == region:
+            return path, size
+    for file_region, path, size in files:
+        if file_region is None:
+            return path, size
+    return None, None
 
 def update_database_with_local_files():
-    """Update database entries with local file paths"""
+    """Update database entries with local file paths
+    
+    Year directories are listed once, file names are parsed into
+    subject/year/set/region/type, and all updates are applied with a single
+    executemany in one transaction. Papers whose previous local file has
+    disappeared get their local_path cleared.
+    """
     conn = get_db()
     cursor = conn.cursor()
     
-    # Get all papers
-    cursor.execute('SELECT id, title, year_id FROM papers')
+    cursor.execute('''
+        SELECT p.id, p.set_code, p.paper_type, p.local_path, p.file_size,
+               s.name as subject, y.year, r.name as region
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        JOIN regions r ON p.region_id = r.id
+    ''')
     papers = cursor.fetchall()
     
-    # Get year mapping
-    cursor.execute('SELECT id, year FROM years')
-    years = {row['id']: row['year'] for row in cursor.fetchall()}
-    
-    updated_count = 0
+    index = index_local_files(sorted({paper['year'] for paper in papers}))
     
+    updates = []
     for paper in papers:
-        year = years.get(paper['year_id'])
-        if not year:
-            continue
-        
-        year_dir = os.path.join(PAPERS_DIR, str(year))
-        if not os.path.exists(year_dir):
-            continue
-        
-        # Find matching PDF file
-        title_lower = paper['title'].lower()
-        for filename in os.listdir(year_dir):
-            if filename.lower().endswith('.pdf'):
-                file_path = os.path.join(year_dir, filename)
-                
-                # Update database with local path
-                cursor.execute('''
-                    UPDATE papers SET local_path = ? WHERE id = ?
-                ''', (file_path, paper['id']))
-                updated_count += 1
-                break
-    
-    conn.commit()
+        path, size = match_local_file(
+            index, paper['subject'], paper['year'], paper['region'],
+            paper['set_code'], paper['paper_type']
+        )
+        if path:
+            if path != paper['local_path'] or size != paper['file_size']:
+                updates.append((path, size, paper['id']))
+        elif paper['local_path'] and not os.path.exists(paper['local_path']):
+            updates.append((None, None, paper['id']))
+    
+    with conn:
+        cursor.executemany('UPDATE papers SET local_path = ?, file_size = ? WHERE id = ?', updates)
     conn.close()
-    print(f"Updated {updated_count} papers with local file paths")
+    
+    updated_count = sum(1 for path, _, _ in updates if path)
+    cleared_count = len(updates) - updated_count
+    print(f"Updated {updated_count} papers with local file paths ({cleared_count} stale paths cleared)")
 
-def download_all_papers():
-    """Download all available papers from CBSE"""
+def download_all_papers(workers=4, processes=None, rate=0.5, preextract=False):
+    """Download all available papers from CBSE
+    
+    Archives are fetched by a thread pool, paced per host by a token bucket
+    (`rate` requests per second), and synced into static/papers/ by a process
+    pool as soon as each one lands, rewriting only PDFs whose CRC changed.
+    Progress is recorded in a manifest after every archive, so an
+    interrupted or repeated run skips archives that are unchanged and
+    already extracted. With `preextract`, each new or changed archive is
+    also extracted into the web app's cache/ by paper ID.
+    """
     ensure_dirs()
+    fetcher.host_rate = rate
+    manifest = load_manifest()
+    pre_extractor = PreExtractor() if preextract else None
     
-    total_files = 0
+    jobs = [(year, subject, url) for year, subjects in CBSE_URLS.items() for subject, url in subjects.items()]
+    totals = {'added': [], 'updated': [], 'unchanged': [], 'removed': []}
+    skipped = 0
+    failed = 0
+    done = 0
+    started = time.time()
     
-    for year, subjects in CBSE_URLS.items():
-        print(f"\n=== Year {year} ===")
-        for subject, url in subjects.items():
-            files = download_and_extract_zip(url, year, subject)
-            total_files += len(files)
-            time.sleep(2)  # Be nice to the server
+    def progress(year, subject, status):
+        print(f"[{done}/{len(jobs)}] {subject} {year}: {status} ({time.time() - started:.1f}s)")
+    
+    with ThreadPoolExecutor(max_workers=workers) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=processes) as extract_pool:
+        pending = {fetch_pool.submit(fetch_archive, job[2]): ('fetch', job) for job in jobs}
+        
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, (year, subject, url) = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    done += 1
+                    failed += 1
+                    progress(year, subject, f"failed ({e})")
+                    continue
+                
+                if stage == 'fetch':
+                    zip_path, fetch_result = result
+                    if fetch_result['status'] == 304 and is_harvested(manifest, url, zip_path):
+                        done += 1
+                        skipped += 1
+                        progress(year, subject, "unchanged, skipped")
+                        continue
+                    if pre_extractor:
+                        pre_extractor.submit(zip_path, year, subject, CACHE_DIR,
+                                             refresh=fetch_result['status'] != 304)
+                    sync_future = extract_pool.submit(
+                        sync_archive, zip_path, year, subject,
+                        get_manifest_files(manifest, url), PAPERS_DIR
+                    )
+                    pending[sync_future] = ('sync', (year, subject, url))
+                else:
+                    done += 1
+                    files, report = result
+                    for key in totals:
+                        totals[key].extend(report[key])
+                    manifest[url] = make_manifest_entry(url, year, subject, files)
+                    save_manifest(manifest)
+                    progress(year, subject, format_sync_report(report))
     
     print(f"\n=== Download Complete ===")
-    print(f"Total files extracted: {total_files}")
+    for key in ('added', 'updated', 'removed'):
+        for path in totals[key]:
+            print(f"  {key}: {os.path.relpath(path, PAPERS_DIR)}")
+    print(f"Files: {format_sync_report(totals)}")
+    print(f"Unchanged archives skipped: {skipped}, failed: {failed}")
     
     # Update database
     update_database_with_local_files()
+    
+    if pre_extractor:
+        pre_extractor.shutdown(wait=True)
 
 if __name__ == '__main__':
-    download_all_papers()
+    parser = argparse.ArgumentParser(description='Download CBSE papers into static/papers/')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent archive downloads')
+    parser.add_argument('--processes', type=int, default=None, help='Extraction processes (default: CPU count)')
+    parser.add_argument('--rate', type=float, default=0.5, help='Requests per second to the CBSE host')
+    parser.add_argument('--preextract', action='store_true',
+                        help="Also extract each new archive into the web app's cache/ by paper ID")
+    args = parser.parse_args()
+    download_all_papers(args.workers, args.processes, args.rate, args.preextract)
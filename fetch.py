@@ -0,0 +1,326 @@
+"""Shared HTTP client for fetching CBSE archives
+
+All CBSE downloads (the web app's ZIP cache and the download_papers
+harvester) go through one pooled requests.Session so connections are kept
+alive and reused. Requests are retried with exponential backoff and full
+jitter on timeouts, connection errors and 5xx/429 responses, limited to a
+few concurrent requests per host, and can be made conditional on the ETag /
+Last-Modified recorded for a previously cached copy.
+"""
+import os
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from singleflight import atomic_writer
+
+# Request headers to mimic browser
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+VALIDATORS_SUFFIX = '.meta.json'
+PART_SUFFIX = '.part'
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+class FetchError(Exception):
+    """Raised when a URL could not be fetched after all retries"""
+
+class _RestartDownload(Exception):
+    """The partial download is unusable and has been discarded"""
+
+class TokenBucket:
+    """Thread-safe token bucket pacing the requests sent to one host"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Fetcher:
+    """Pooled, retrying HTTP client with per-host concurrency and rate limits
+
+    `host_rate` (requests per second, None for unlimited) and `host_burst`
+    pace requests per host, e.g. to stay polite during a bulk harvest.
+    """
+
+    def __init__(self, headers=None, timeout=(10, 120), max_retries=4,
+                 backoff_base=1.0, backoff_cap=30.0, per_host_limit=4,
+                 host_rate=None, host_burst=1):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.per_host_limit = per_host_limit
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS if headers is None else headers)
+        # Retries are handled here so backoff covers both errors and 5xx
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=per_host_limit, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._host_slots = {}
+        self._host_buckets = {}
+        self._host_slots_guard = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, url):
+        """Hold one of the host's concurrent request slots"""
+        host = urlsplit(url).netloc
+        with self._host_slots_guard:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+        with slot:
+            yield
+
+    def throttle(self, url):
+        """Wait for the host's rate limit, if one is set"""
+        if not self.host_rate:
+            return
+        host = urlsplit(url).netloc
+        with self._host_slots_guard:
+            bucket = self._host_buckets.get(host)
+            if bucket is None or bucket.rate != self.host_rate:
+                bucket = self._host_buckets[host] = TokenBucket(self.host_rate, self.host_burst)
+        bucket.acquire()
+
+    def backoff_delay(self, attempt, response=None):
+        """Get how long to wait before retry number `attempt` (0-based)"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_cap)
+        # Full jitter: uniform between 0 and the exponential ceiling
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @contextmanager
+    def open(self, url, validators=None, headers=None, stream=True):
+        """Open a URL with retries, yielding the response and closing it afterwards
+
+        A 304 response is returned as-is when `validators` were sent.
+        """
+        request_headers = dict(headers or {})
+        request_headers.update(conditional_headers(validators))
+
+        with self.host_slot(url):
+            attempt = 0
+            while True:
+                self.throttle(url)
+                try:
+                    response = self.session.get(url, headers=request_headers,
+                                                timeout=self.timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt >= self.max_retries:
+                        raise FetchError(f"{url}: {e}") from e
+                    time.sleep(self.backoff_delay(attempt))
+                    attempt += 1
+                    continue
+
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    delay = self.backoff_delay(attempt, response)
+                    response.close()
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                break
+
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def get(self, url, validators=None, headers=None):
+        """Fetch a URL with retries, returning the response with its body loaded"""
+        with self.open(url, validators, headers, stream=False) as response:
+            return response
+
+    def download_to_file(self, url, dest_path, validators=None, headers=None):
+        """Stream a URL to dest_path through a resumable .part file
+
+        The body is written in chunks, checked against Content-Length (and
+        Content-MD5 when sent), then renamed into place. An interrupted
+        download leaves the .part file behind and the next call resumes it
+        with a Range request. Returns a dict with the final status (200, or
+        304 when `validators` matched), size and sha256. Restarting from
+        scratch (the partial copy no longer matches) counts as a retry.
+        """
+        part_path = dest_path + PART_SUFFIX
+        attempt = 0
+        while True:
+            try:
+                return self._download_once(url, dest_path, part_path, validators, headers)
+            except _RestartDownload as e:
+                if attempt >= self.max_retries:
+                    raise FetchError(f"{url}: download kept restarting ({e})") from e
+                attempt += 1
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                # Mid-body failures resume from what reached the .part file
+                if attempt >= self.max_retries:
+                    raise FetchError(f"{url}: {e}") from e
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+
+    def _download_once(self, url, dest_path, part_path, validators, headers):
+        # The file is stored byte-for-byte as served, so sizes and ranges
+        # always refer to the same bytes
+        request_headers = {'Accept-Encoding': 'identity'}
+        request_headers.update(headers or {})
+        part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        part_validators = load_validators(part_path) if part_size else {}
+        if part_size and (part_validators.get('etag') or part_validators.get('last_modified')):
+            request_headers['Range'] = f"bytes={part_size}-"
+            request_headers['If-Range'] = part_validators.get('etag') or part_validators['last_modified']
+            validators = None
+        else:
+            part_size = 0
+
+        with self.open(url, validators, request_headers) as response:
+            if response.status_code == 304:
+                return {'status': 304, 'size': os.path.getsize(dest_path), 'sha256': None}
+            if response.status_code == 416:
+                # Our partial copy no longer lines up with the resource
+                _remove(part_path)
+                _remove(part_path + VALIDATORS_SUFFIX)
+                raise _RestartDownload("range not satisfiable")
+            if response.status_code not in (200, 206):
+                raise FetchError(f"{url}: HTTP {response.status_code}")
+
+            digest = hashlib.sha256()
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                if not content_range.startswith(f"bytes {part_size}-"):
+                    raise FetchError(f"{url}: unexpected Content-Range {content_range!r}")
+                expected_size = parse_range_total(content_range)
+                if expected_size is None and response.headers.get('Content-Length', '').isdigit():
+                    expected_size = part_size + int(response.headers['Content-Length'])
+                mode = 'ab'
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            else:
+                content_length = response.headers.get('Content-Length', '')
+                expected_size = int(content_length) if content_length.isdigit() else None
+                mode = 'wb'
+                save_validators(part_path, response)
+
+            with open(part_path, mode) as f:
+                for chunk in iter_raw_body(response):
+                    f.write(chunk)
+                    digest.update(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            size = os.path.getsize(part_path)
+            if expected_size is not None and size > expected_size:
+                _remove(part_path)
+                raise _RestartDownload(f"got {size} of {expected_size} bytes")
+            if expected_size is not None and size != expected_size:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"{url}: got {size} of {expected_size} bytes"
+                )
+            content_md5 = response.headers.get('Content-MD5')
+            if content_md5 and response.status_code == 200:
+                with open(part_path, 'rb') as f:
+                    md5 = hashlib.md5()
+                    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        md5.update(chunk)
+                if base64.b64encode(md5.digest()).decode() != content_md5:
+                    _remove(part_path)
+                    raise FetchError(f"{url}: Content-MD5 mismatch")
+
+            os.replace(part_path, dest_path)
+            _remove(part_path + VALIDATORS_SUFFIX)
+            save_validators(dest_path, response, sha256=digest.hexdigest(), size=size)
+            return {'status': 200, 'size': size, 'sha256': digest.hexdigest()}
+
+def iter_raw_body(response):
+    """Yield a streamed response's body exactly as sent, without decoding Content-Encoding
+
+    Read errors are raised as the requests exceptions iter_content would
+    give, so callers retry them the same way.
+    """
+    try:
+        yield from response.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except ReadTimeoutError as e:
+        raise requests.ConnectionError(e) from e
+
+def parse_range_total(content_range):
+    """Get the complete length from a Content-Range header, or None if it is unknown (*)"""
+    total = content_range.rsplit('/', 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def conditional_headers(validators):
+    """Build If-None-Match / If-Modified-Since headers from stored validators"""
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def load_validators(path):
+    """Load the ETag / Last-Modified stored for a cached download"""
+    try:
+        with open(path + VALIDATORS_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validators(path, response, **extra):
+    """Store a response's ETag / Last-Modified next to the file it was saved to"""
+    validators = {
+        'url': response.url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    }
+    validators.update(extra)
+    with atomic_writer(path + VALIDATORS_SUFFIX, 'w') as f:
+        json.dump(validators, f)
+
+# Shared client used by the app and the download scripts
+fetcher = Fetcher(
+    max_retries=int(os.environ.get('FETCH_MAX_RETRIES', 4)),
+    per_host_limit=int(os.environ.get('FETCH_PER_HOST_LIMIT', 4)),
+)
@@ -0,0 +1,221 @@
+"""Shared in-memory tier for the most requested PDFs
+
+Copies of the hottest papers are kept in a directory on a RAM-backed
+filesystem (/dev/shm by default), so any gunicorn worker on the host can
+serve them without touching the disk. Request counts live in a SQLite index
+in the same directory and are halved every `decay_interval` seconds, so the
+tier follows what is popular now (e.g. during exam week) rather than all
+time. A paper is admitted once it has `min_requests` requests and is
+requested more than the coldest resident paper; the coldest residents are
+dropped to stay within `max_papers` and `max_bytes`, and a paper that only
+fits by dropping residents still being served is not admitted.
+"""
+import os
+import time
+import shutil
+import sqlite3
+import threading
+from singleflight import atomic_writer
+
+INDEX_NAME = '.hot_index.db'
+# Residents served this recently are not dropped, so a file is not deleted
+# between being looked up and being sent
+EVICT_MIN_IDLE = 5
+
+INDEX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS requests (
+        paper_id INTEGER PRIMARY KEY,
+        count REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS residents (
+        paper_id INTEGER PRIMARY KEY,
+        size INTEGER NOT NULL,
+        source_size INTEGER NOT NULL,
+        source_mtime_ns INTEGER NOT NULL,
+        last_served REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+'''
+
+class HotPdfCache:
+    """Top-N most requested PDFs, copied into shared memory"""
+
+    def __init__(self, hot_dir, max_papers=50, max_bytes=48 * 1024 ** 2, min_requests=3,
+                 decay_interval=3600):
+        self.hot_dir = hot_dir
+        self.max_papers = max_papers
+        self.max_bytes = max_bytes
+        self.min_requests = min_requests
+        self.decay_interval = decay_interval
+        self.index_path = os.path.join(hot_dir, INDEX_NAME)
+        self._local = threading.local()
+        self.connect()
+
+    def connect(self):
+        """Get this thread's connection to the tier's index"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.hot_dir, exist_ok=True)
+            conn = sqlite3.connect(self.index_path, timeout=5)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')  # the index is as volatile as the tier
+            conn.executescript(INDEX_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def path_for(self, paper_id):
+        """Get the path a paper's in-memory copy is stored under"""
+        return os.path.join(self.hot_dir, f"paper_{paper_id}.pdf")
+
+    def _count(self, conn, name, amount=1):
+        conn.execute('''
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', (name, amount))
+
+    def _decay(self, conn, now):
+        """Halve every request count once per decay interval"""
+        row = conn.execute("SELECT value FROM counters WHERE name = 'last_decay'").fetchone()
+        if row is None:
+            conn.execute("INSERT INTO counters (name, value) VALUES ('last_decay', ?)", (now,))
+        elif now - row[0] >= self.decay_interval:
+            conn.execute('UPDATE requests SET count = count / 2')
+            conn.execute('DELETE FROM requests WHERE count < 0.5 AND paper_id NOT IN (SELECT paper_id FROM residents)')
+            conn.execute("UPDATE counters SET value = ? WHERE name = 'last_decay'", (now,))
+
+    def request(self, paper_id, source_path):
+        """Count a request for a paper and get the path to serve it from
+
+        Returns the in-memory copy if the paper is resident and up to date,
+        otherwise `source_path` (admitting the paper first if it has become
+        hot enough).
+        """
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return source_path
+
+        now = time.time()
+        with self.connect() as conn:
+            self._decay(conn, now)
+            conn.execute('''
+                INSERT INTO requests (paper_id, count) VALUES (?, 1)
+                ON CONFLICT(paper_id) DO UPDATE SET count = count + 1
+            ''', (paper_id,))
+            self._count(conn, 'requests')
+            resident = conn.execute(
+                'SELECT source_size, source_mtime_ns FROM residents WHERE paper_id = ?', (paper_id,)
+            ).fetchone()
+            if resident == (stat.st_size, stat.st_mtime_ns) and os.path.exists(self.path_for(paper_id)):
+                conn.execute('UPDATE residents SET last_served = ? WHERE paper_id = ?', (now, paper_id))
+                self._count(conn, 'hits')
+                return self.path_for(paper_id)
+            admit = self._should_admit(conn, paper_id, stat.st_size)
+
+        if admit:
+            self._admit(paper_id, source_path, stat)
+        return source_path
+
+    def _should_admit(self, conn, paper_id, size):
+        if size > self.max_bytes:
+            return False
+        count = conn.execute('SELECT count FROM requests WHERE paper_id = ?', (paper_id,)).fetchone()[0]
+        if count < self.min_requests:
+            return False
+        residents = conn.execute('SELECT COUNT(*) FROM residents WHERE paper_id != ?', (paper_id,)).fetchone()[0]
+        if residents < self.max_papers:
+            return True
+        coldest = conn.execute('''
+            SELECT MIN(q.count) FROM residents r JOIN requests q ON q.paper_id = r.paper_id
+            WHERE r.paper_id != ?
+        ''', (paper_id,)).fetchone()[0]
+        if coldest is not None and count <= coldest:
+            return False
+        # Check before copying that dropping idle residents makes enough room
+        return self._make_room(conn, paper_id, size) is not None
+
+    def _make_room(self, conn, paper_id, size):
+        """Pick the coldest idle residents to drop so a paper of `size` bytes fits
+
+        Returns their paper IDs, or None if the paper does not fit even with
+        every idle resident gone.
+        """
+        count, total = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM residents WHERE paper_id != ?', (paper_id,)
+        ).fetchone()
+        count += 1
+        total += size
+        candidates = conn.execute('''
+            SELECT r.paper_id, r.size FROM residents r
+            LEFT JOIN requests q ON q.paper_id = r.paper_id
+            WHERE r.paper_id != ? AND r.last_served < ?
+            ORDER BY COALESCE(q.count, 0), r.last_served
+        ''', (paper_id, time.time() - EVICT_MIN_IDLE)).fetchall()
+        victims = []
+        for victim_id, victim_size in candidates:
+            if count <= self.max_papers and total <= self.max_bytes:
+                break
+            victims.append(victim_id)
+            count -= 1
+            total -= victim_size
+        if count > self.max_papers or total > self.max_bytes:
+            return None
+        return victims
+
+    def _admit(self, paper_id, source_path, stat):
+        """Copy a paper into the tier, then drop the coldest residents to fit"""
+        hot_path = self.path_for(paper_id)
+        try:
+            with open(source_path, 'rb') as src, atomic_writer(hot_path) as dst:
+                shutil.copyfileobj(src, dst)
+        except OSError as e:
+            print(f"Could not admit paper {paper_id} to the hot PDF tier: {e}")
+            return
+
+        dropped = []
+        with self.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Residents may have been served while the copy was made
+            victims = self._make_room(conn, paper_id, stat.st_size)
+            if victims is None:
+                conn.execute('DELETE FROM residents WHERE paper_id = ?', (paper_id,))
+                dropped.append(paper_id)
+            else:
+                conn.execute('''
+                    INSERT OR REPLACE INTO residents (paper_id, size, source_size, source_mtime_ns, last_served)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (paper_id, stat.st_size, stat.st_size, stat.st_mtime_ns, time.time()))
+                self._count(conn, 'admissions')
+                conn.executemany('DELETE FROM residents WHERE paper_id = ?', [(victim_id,) for victim_id in victims])
+                dropped.extend(victims)
+                if victims:
+                    self._count(conn, 'evictions', len(victims))
+
+        for victim_id in dropped:
+            try:
+                os.unlink(self.path_for(victim_id))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Get the tier's residents, size and request/hit/admission counters"""
+        conn = self.connect()
+        residents, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM residents').fetchone()
+        counters = dict(conn.execute('SELECT name, value FROM counters'))
+        conn.rollback()
+        requests = int(counters.get('requests', 0))
+        hits = int(counters.get('hits', 0))
+        return {
+            'max_papers': self.max_papers,
+            'max_bytes': self.max_bytes,
+            'papers': residents,
+            'size_bytes': size,
+            'requests': requests,
+            'hits': hits,
+            'hit_ratio': round(hits / requests, 4) if requests else None,
+            'admissions': int(counters.get('admissions', 0)),
+            'evictions': int(counters.get('evictions', 0)),
+        }
@@ -0,0 +1,160 @@
+"""Script to index the text of cached and local PDFs for content search
+
+Text is extracted page by page in a process pool and stored in the
+paper_pages_fts index. Runs are incremental: a PDF whose size and mtime are
+unchanged is skipped, and one whose sha256 matches what was indexed only has
+its stat refreshed. PDFs shared by several papers are extracted once.
+"""
+import os
+import json
+import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from paper_files import existing_pdf_path
+from database import get_db, init_db, has_search_index
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    """Get the sha256 of a file on disk"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def extract_pdf_pages(path):
+    """Extract the text of each page of a PDF (runs in a worker process)"""
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(page.extract_text() or '')
+        except Exception as e:
+            print(f"  Could not read a page of {path}: {e}")
+            pages.append('')
+    return pages
+
+def find_pdfs_to_index(conn, force=False):
+    """Work out which papers need (re)indexing
+
+    Returns (pending, refreshed, removed): pending maps file hash to
+    (path, [(paper_id, size, mtime)]), refreshed lists papers whose file was
+    touched but not changed, removed lists indexed papers whose PDF is gone.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, local_path FROM papers')
+    papers = cursor.fetchall()
+    cursor.execute('SELECT paper_id, file_hash, file_size, file_mtime FROM paper_texts')
+    indexed = {row['paper_id']: row for row in cursor.fetchall()}
+
+    pending = {}
+    refreshed = []
+    removed = set(indexed)
+    for paper in papers:
+        path = existing_pdf_path(dict(paper))
+        if path is None:
+            continue
+        removed.discard(paper['id'])
+        stat = os.stat(path)
+        previous = indexed.get(paper['id'])
+        if (not force and previous is not None and previous['file_size'] == stat.st_size
+                and previous['file_mtime'] == stat.st_mtime):
+            continue
+
+        file_hash = file_sha256(path)
+        if not force and previous is not None and previous['file_hash'] == file_hash:
+            refreshed.append((stat.st_size, stat.st_mtime, paper['id']))
+            continue
+        entry = pending.setdefault(file_hash, (path, []))
+        entry[1].append((paper['id'], stat.st_size, stat.st_mtime))
+    return pending, refreshed, sorted(removed)
+
+def remove_paper_text(cursor, paper_id):
+    """Drop a paper's indexed pages, deleting them by rowid
+
+    paper_id is an UNINDEXED column, so filtering on it would scan the whole
+    page index; only rows indexed before page_rowids was recorded need that.
+    """
+    cursor.execute('SELECT page_rowids FROM paper_texts WHERE paper_id = ?', (paper_id,))
+    row = cursor.fetchone()
+    if row is not None and row['page_rowids'] is not None:
+        cursor.executemany('DELETE FROM paper_pages_fts WHERE rowid = ?',
+                           [(rowid,) for rowid in json.loads(row['page_rowids'])])
+    elif row is not None:
+        cursor.execute('DELETE FROM paper_pages_fts WHERE paper_id = ?', (paper_id,))
+    cursor.execute('DELETE FROM paper_texts WHERE paper_id = ?', (paper_id,))
+
+def store_paper_text(cursor, paper_id, file_hash, size, mtime, pages):
+    """Replace the indexed pages of one paper"""
+    remove_paper_text(cursor, paper_id)
+    rowids = []
+    for number, text in enumerate(pages, start=1):
+        if text.strip():
+            cursor.execute('INSERT INTO paper_pages_fts (content, paper_id, page) VALUES (?, ?, ?)',
+                           (text, paper_id, number))
+            rowids.append(cursor.lastrowid)
+    cursor.execute('''
+        INSERT INTO paper_texts (paper_id, file_hash, file_size, file_mtime, page_count, page_rowids)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (paper_id, file_hash, size, mtime, len(pages), json.dumps(rowids)))
+
+def index_pdf_content(workers=None, force=False):
+    """Extract and index the text of every new or changed PDF"""
+    if PdfReader is None:
+        print("pypdf is not installed; run: pip install pypdf")
+        return
+
+    init_db()
+    conn = get_db()
+    if not has_search_index(conn, 'paper_pages_fts'):
+        print("SQLite has no FTS5 support; content search is unavailable")
+        conn.close()
+        return
+
+    pending, refreshed, removed = find_pdfs_to_index(conn, force)
+    cursor = conn.cursor()
+    cursor.executemany(
+        'UPDATE paper_texts SET file_size = ?, file_mtime = ? WHERE paper_id = ?', refreshed
+    )
+    for paper_id in removed:
+        remove_paper_text(cursor, paper_id)
+    conn.commit()
+    print(f"Indexing {len(pending)} PDFs ({len(refreshed)} unchanged, {len(removed)} removed)")
+
+    indexed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(extract_pdf_pages, path): file_hash
+            for file_hash, (path, _) in pending.items()
+        }
+        for future in as_completed(futures):
+            file_hash = futures[future]
+            path, papers = pending[file_hash]
+            try:
+                pages = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  Failed to extract {path}: {e}")
+                continue
+
+            for paper_id, size, mtime in papers:
+                store_paper_text(cursor, paper_id, file_hash, size, mtime, pages)
+            conn.commit()
+            indexed += 1
+            print(f"  {os.path.basename(path)}: {len(pages)} pages -> papers {[p[0] for p in papers]}")
+
+    conn.close()
+    print(f"Indexed {indexed} PDFs, {failed} failed")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, help='Extraction processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='Reindex every PDF')
+    args = parser.parse_args()
+    index_pdf_content(args.workers, args.force)
@@ -0,0 +1,26 @@
+"""Where a paper's PDF lives on disk
+
+Shared by the web app and the offline scripts, so resolving a paper's PDF
+does not require importing the Flask app.
+"""
+import os
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+
+def paper_cache_path(cache_dir, paper_id):
+    """Get the path a paper's extracted PDF is cached under"""
+    return os.path.join(cache_dir, f"paper_{paper_id}.pdf")
+
+def existing_pdf_path(paper, cache_dir=CACHE_DIR):
+    """Get the path of a paper's PDF if it is already cached or stored locally"""
+    cache_path = paper_cache_path(cache_dir, paper['id'])
+    
+    # Check cache first
+    if os.path.exists(cache_path):
+        return cache_path
+    
+    # Check local file
+    if paper.get('local_path') and os.path.exists(paper['local_path']):
+        return paper['local_path']
+    
+    return None
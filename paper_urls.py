@@ -2,6 +2,8 @@
 Direct PDF URLs for CBSE Class 12 Papers
 URLs sourced from CBSE official website and verified mirrors
 """
+import os
+import re
 
 # CBSE Official ZIP URLs (contain all sets for each subject/year)
 CBSE_OFFICIAL_ZIPS = {
@@ -90,3 +92,94 @@ def get_supercop_page_url(subject, year):
     if subject in subject_names:
         return f"{SUPERCOP_BASE}/{subject_names[subject]}-{year}/"
     return None
+
+# Paper codes appear in archive member names as 67-1-1, 67_1_1 or 67/1/1
+PAPER_CODE_PATTERN = re.compile(r'(?<!\d)(\d{1,3})[-_/](\d{1,2})[-_/](\d{1,2})(?!\d)')
+SET_NAME_PATTERN = re.compile(r'set[\s_-]*(\d+)', re.IGNORECASE)
+
+def parse_paper_code(filename):
+    """Parse a CBSE paper code like 67-1-1 from a filename into (subject code, series, set)"""
+    match = PAPER_CODE_PATTERN.search(os.path.basename(filename))
+    if match:
+        return match.group(1), match.group(2), match.group(3)
+    return None
+
+def parse_set_number(filename):
+    """Get the set number a paper file belongs to (e.g. '67-1-2.pdf' -> '2')"""
+    code = parse_paper_code(filename)
+    if code:
+        return code[2]
+    match = SET_NAME_PATTERN.search(os.path.basename(filename))
+    if match:
+        return match.group(1)
+    return None
+
+def paper_code_sort_key(paper_code, name):
+    """Sort key putting papers in numeric (series, set) order, 67-2-1 before 67-10-1
+
+    Papers without a parsed code ("67-1-2" style) come last, by name.
+    """
+    if paper_code:
+        _, series, set_num = paper_code.split('-')
+        return (0, int(series), int(set_num), name)
+    return (1, 0, 0, name)
+
+# Subject key for each CBSE paper-code prefix (67 -> accountancy)
+SUBJECT_BY_PAPER_CODE = {
+    codes[0].split('-')[0]: subject
+    for subject, years in PAPER_CODES.items()
+    for codes in years.values()
+}
+
+# Region names as they appear in file names, most specific first
+REGION_KEYWORDS = [
+    ('outside_delhi', ('outside_delhi', 'outside-delhi', 'outsidedelhi', 'outside')),
+    ('all_india', ('all_india', 'all-india', 'allindia')),
+    ('foreign', ('foreign',)),
+    ('delhi', ('delhi',)),
+]
+
+MARKING_SCHEME_PATTERN = re.compile(r'(marking|scheme|solution|(?<![a-z])ms(?![a-z]))')
+
+def parse_paper_filename(filename):
+    """Parse subject, year, paper code, set, region and paper type from a PDF file name
+
+    Understands the names written by download_papers.py, e.g.
+    'accountancy_2024_67-1-2.pdf' or 'economics_2023_58_2_1_MS.pdf'.
+    Fields that cannot be determined are None.
+    """
+    name = os.path.basename(filename).lower()
+    stem = os.path.splitext(name)[0]
+
+    subject = None
+    for key in sorted(SUBJECT_CODES, key=len, reverse=True):
+        if stem.startswith(key + '_'):
+            subject = key
+            stem = stem[len(key) + 1:]
+            break
+
+    year = None
+    year_match = re.match(r'(20\d\d)(?:_|$)', stem)
+    if year_match:
+        year = int(year_match.group(1))
+        stem = stem[year_match.end():]
+
+    code = parse_paper_code(stem)
+    if subject is None and code:
+        subject = SUBJECT_BY_PAPER_CODE.get(code[0])
+
+    region = None
+    for region_key, keywords in REGION_KEYWORDS:
+        if any(keyword in stem for keyword in keywords):
+            region = region_key
+            break
+
+    return {
+        'subject': subject,
+        'year': year,
+        'paper_code': '-'.join(code) if code else None,
+        'series': code[1] if code else None,
+        'set_num': parse_set_number(stem),
+        'region': region,
+        'paper_type': 'marking_scheme' if MARKING_SCHEME_PATTERN.search(stem) else 'question_paper',
+    }
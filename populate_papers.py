@@ -1,8 +1,7 @@
 """Script to populate the database with CBSE paper metadata"""
 import os
 from database import (
-    get_db, init_db, seed_initial_data, add_paper,
-    get_subject_by_name, get_year_by_value, get_region_by_name
+    init_db, seed_initial_data, bulk_upsert_papers, get_dimension_ids
 )
 
 # Define subjects and their URL patterns
@@ -140,32 +139,36 @@ def generate_paper_entries():
     return papers
 
 def populate_database():
-    """Populate the database with paper entries"""
+    """Populate the database with paper entries
+    
+    Dimension IDs are resolved once and all entries are upserted in a single
+    transaction, so running this again updates rows instead of duplicating them.
+    """
     # Initialize database
     init_db()
     seed_initial_data()
     
-    papers = generate_paper_entries()
-    added_count = 0
+    subject_ids, year_ids, region_ids = get_dimension_ids()
+    rows = []
     
-    for paper in papers:
-        subject = get_subject_by_name(paper['subject'])
-        year = get_year_by_value(paper['year'])
-        region = get_region_by_name(paper['region'])
+    for paper in generate_paper_entries():
+        subject_id = subject_ids.get(paper['subject'])
+        year_id = year_ids.get(paper['year'])
+        region_id = region_ids.get(paper['region'])
         
-        if subject and year and region:
-            add_paper(
-                subject_id=subject['id'],
-                year_id=year['id'],
-                region_id=region['id'],
-                set_code=paper['set_code'],
-                paper_type=paper['paper_type'],
-                title=paper['title'],
-                pdf_url=paper['pdf_url']
-            )
-            added_count += 1
+        if subject_id and year_id and region_id:
+            rows.append({
+                'subject_id': subject_id,
+                'year_id': year_id,
+                'region_id': region_id,
+                'set_code': paper['set_code'],
+                'paper_type': paper['paper_type'],
+                'title': paper['title'],
+                'pdf_url': paper['pdf_url'],
+            })
     
-    print(f"Added {added_count} paper entries to the database")
+    added_count = bulk_upsert_papers(rows)
+    print(f"Added or updated {added_count} paper entries in the database")
 
 if __name__ == '__main__':
     populate_database()
@@ -0,0 +1,114 @@
+"""Extract CBSE archive members into the PDF cache
+
+Papers are extracted to cache/paper_<id>.pdf: the member for each paper is
+found through the archive's index, all needed members are read in one
+sequential pass, and each PDF is written atomically. With pre-extraction
+("explode on ingest") every paper of an archive is extracted in the
+background as soon as the archive is stored, so user downloads are cache
+hits instead of paying the ZIP read on first request.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import get_read_db
+from singleflight import atomic_write_bytes
+from timings import StageTimings
+from zip_index import load_zip_index, find_member, read_members
+from paper_files import CACHE_DIR, paper_cache_path
+
+def get_archive_papers(year, subject):
+    """Get the papers that come from the archive for a year and subject name"""
+    conn = get_read_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT p.id, p.set_code, p.title
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        WHERE s.name = ? AND y.year = ?
+        ORDER BY p.id
+    ''', (subject, year))
+    return [dict(row) for row in cursor.fetchall()]
+
+def extract_archive_to_cache(zip_path, papers, cache_dir, index=None, timings=None, refresh=False):
+    """Extract the given papers' members from an archive into the cache
+
+    Several papers can share a member (e.g. a marking scheme bundled with its
+    set). Papers that are already cached are not extracted again unless
+    `refresh` is set (the archive changed). Returns {paper_id: cache_path}
+    for every paper whose PDF is now cached.
+    """
+    timings = timings or StageTimings()
+    if index is None:
+        with timings.stage('index'):
+            index = load_zip_index(zip_path)
+
+    wanted = {}
+    for paper in papers:
+        member = find_member(index, paper.get('set_code'))
+        if member:
+            wanted.setdefault(member['name'], (member, []))[1].append(paper)
+
+    sources = {}
+    members = []
+    for member, member_papers in wanted.values():
+        cache_paths = [paper_cache_path(cache_dir, paper['id']) for paper in member_papers]
+        if not refresh and all(os.path.exists(path) for path in cache_paths):
+            sources.update((paper['id'], path) for paper, path in zip(member_papers, cache_paths))
+        else:
+            members.append(member)
+
+    def skip_member(member, error):
+        print(f"Error extracting {member['name']} from {zip_path}: {error}")
+
+    try:
+        with timings.stage('extract'):
+            for member, data in read_members(zip_path, members, on_error=skip_member):
+                for paper in wanted[member['name']][1]:
+                    cache_path = paper_cache_path(cache_dir, paper['id'])
+                    try:
+                        if refresh or not os.path.exists(cache_path):
+                            atomic_write_bytes(cache_path, data)
+                    except OSError as e:
+                        print(f"Error caching paper {paper['id']}: {e}")
+                        continue
+                    sources[paper['id']] = cache_path
+    except Exception as e:
+        print(f"Error extracting PDFs from {zip_path}: {e}")
+    return sources
+
+class PreExtractor:
+    """Background worker that extracts every paper of newly stored archives"""
+
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preextract')
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def submit(self, zip_path, year, subject, cache_dir=CACHE_DIR, refresh=False):
+        """Queue an archive for extraction; ignored if it is already queued"""
+        with self.lock:
+            if zip_path in self.in_flight:
+                return None
+            self.in_flight.add(zip_path)
+        return self.executor.submit(self._run, zip_path, year, subject, cache_dir, refresh)
+
+    def shutdown(self, wait=True):
+        """Stop accepting archives, optionally waiting for queued ones to finish"""
+        self.executor.shutdown(wait=wait)
+
+    def _run(self, zip_path, year, subject, cache_dir, refresh):
+        try:
+            papers = get_archive_papers(year, subject)
+            timings = StageTimings()
+            sources = extract_archive_to_cache(zip_path, papers, cache_dir, timings=timings,
+                                               refresh=refresh)
+            print(f"Pre-extracted {len(sources)} of {len(papers)} {subject} {year} papers "
+                  f"({timings.summary()})")
+            return sources
+        except Exception as e:
+            print(f"Pre-extraction of {zip_path} failed: {e}")
+            return {}
+        finally:
+            with self.lock:
+                self.in_flight.discard(zip_path)
@@ -0,0 +1,66 @@
+"""Script to pre-build bulk-download bundles for every subject/year combination"""
+import argparse
+from app import app, build_bundle, ZIP_COMPRESSION_MODES
+from database import get_read_db
+
+PAPER_TYPES = ('question_paper', 'marking_scheme')
+
+def get_bundle_selections(subject=None, year=None):
+    """Get (label, paper_ids) for each subject/year bundle, whole and per paper type"""
+    conn = get_read_db()
+    cursor = conn.cursor()
+    
+    query = '''
+        SELECT p.id, p.paper_type, s.name as subject, y.year
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        WHERE 1=1
+    '''
+    params = []
+    if subject:
+        query += ' AND s.name = ?'
+        params.append(subject)
+    if year:
+        query += ' AND y.year = ?'
+        params.append(year)
+    query += ' ORDER BY y.year DESC, s.name, p.id'
+    
+    cursor.execute(query, params)
+    groups = {}
+    for row in cursor.fetchall():
+        groups.setdefault((row['subject'], row['year']), []).append(row)
+    
+    selections = []
+    for (subject_name, year_value), rows in groups.items():
+        label = f"{subject_name} {year_value}"
+        selections.append((label, [row['id'] for row in rows]))
+        for paper_type in PAPER_TYPES:
+            ids = [row['id'] for row in rows if row['paper_type'] == paper_type]
+            if ids:
+                selections.append((f"{label} ({paper_type})", ids))
+    return selections
+
+def prewarm_bundles(subject=None, year=None, compression=None):
+    """Build every subject/year bundle that is not cached yet"""
+    selections = get_bundle_selections(subject, year)
+    built = 0
+    
+    for label, paper_ids in selections:
+        bundle_key = build_bundle(paper_ids, compression)
+        if bundle_key:
+            built += 1
+            print(f"  {label}: {len(paper_ids)} papers -> {bundle_key[:12]}")
+        else:
+            print(f"  {label}: skipped (some papers could not be fetched)")
+    
+    print(f"Prewarmed {built} of {len(selections)} bundles")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--subject', help='Subject name, e.g. accountancy')
+    parser.add_argument('--year', type=int, help='Exam year, e.g. 2024')
+    parser.add_argument('--compression', choices=sorted(ZIP_COMPRESSION_MODES),
+                        default=app.config['BULK_ZIP_COMPRESSION'])
+    args = parser.parse_args()
+    prewarm_bundles(args.subject, args.year, args.compression)
@@ -0,0 +1,167 @@
+"""Free-text paper search
+
+Queries like "maths 2023 delhi set 2" are turned into an FTS5 MATCH
+expression over papers_fts: every word must match (as a prefix) one of the
+title, subject, region, year, set or type columns, common abbreviations are
+expanded, and "set N" is matched as a phrase. Results are ranked with bm25,
+weighting subject and year matches above incidental title words. Databases
+without FTS5 fall back to the old LIKE scan.
+
+Content search (scope=content) runs the same kind of query against the page
+text indexed by index_pdf_content.py and returns each paper's best pages
+with highlighted snippets.
+"""
+import re
+import sqlite3
+from database import get_read_db, has_search_index
+
+SEARCH_LIMIT = 50
+
+# Shorthand students type, mapped to the words used in the catalog
+SEARCH_ALIASES = {
+    'maths': 'mathematics',
+    'math': 'mathematics',
+    'accounts': 'accountancy',
+    'acc': 'accountancy',
+    'accts': 'accountancy',
+    'bst': 'business studies',
+    'bs': 'business studies',
+    'business': 'business studies',
+    'eco': 'economics',
+    'econ': 'economics',
+    'eng': 'english',
+    'ds': 'data science',
+    'ms': 'marking scheme',
+    'solution': 'marking scheme',
+    'solutions': 'marking scheme',
+    'answers': 'marking scheme',
+    'qp': 'question paper',
+    'ai': 'all india',
+    'od': 'outside delhi',
+}
+
+# bm25 weights for title, subject, region, year, set_code, paper_type
+BM25_WEIGHTS = (1.0, 4.0, 2.0, 3.0, 2.0, 1.0)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Content search: page hits considered, pages shown per paper, snippet markup
+CONTENT_PAGE_LIMIT = 500
+CONTENT_PAGES_PER_PAPER = 3
+SNIPPET_MARKERS = ('[', ']')
+SNIPPET_TOKENS = 16
+
+def build_match_query(text, aliases=True):
+    """Turn free text into an FTS5 MATCH expression, or None if it has no words"""
+    tokens = [token.lower() for token in TOKEN_PATTERN.findall(text)]
+    terms = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'set' and i + 1 < len(tokens) and tokens[i + 1].isdigit():
+            terms.append(f'"set {tokens[i + 1]}"')
+            i += 2
+            continue
+
+        term = f'"{token}"*'
+        alias = SEARCH_ALIASES.get(token) if aliases else None
+        if alias:
+            term = f'({term} OR "{alias}")'
+        terms.append(term)
+        i += 1
+    return ' AND '.join(terms) or None
+
+def search_papers(text, limit=SEARCH_LIMIT):
+    """Search papers by free text, best matches first"""
+    conn = get_read_db()
+    match = build_match_query(text)
+    if match is None:
+        return []
+    if has_search_index(conn):
+        try:
+            return search_papers_fts(conn, match, limit)
+        except sqlite3.OperationalError as e:
+            print(f"FTS search failed for {text!r}: {e}")
+    return search_papers_like(conn, text, limit)
+
+def search_papers_fts(conn, match, limit):
+    cursor = conn.cursor()
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    cursor.execute(f'''
+        SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
+        FROM papers_fts
+        JOIN papers p ON p.id = papers_fts.rowid
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        JOIN regions r ON p.region_id = r.id
+        WHERE papers_fts MATCH ?
+        ORDER BY bm25(papers_fts, {weights}), y.year DESC, s.display_name, p.id
+        LIMIT ?
+    ''', (match, limit))
+    return [dict(p) for p in cursor.fetchall()]
+
+def search_papers_like(conn, text, limit):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        JOIN regions r ON p.region_id = r.id
+        WHERE p.title LIKE ?
+        ORDER BY y.year DESC, s.display_name
+        LIMIT ?
+    ''', (f'%{text}%', limit))
+    return [dict(p) for p in cursor.fetchall()]
+
+def search_content(text, limit=SEARCH_LIMIT):
+    """Search the text of indexed PDFs, returning papers with their matching pages"""
+    conn = get_read_db()
+    match = build_match_query(text, aliases=False)
+    if match is None or not has_search_index(conn, 'paper_pages_fts'):
+        return []
+
+    cursor = conn.cursor()
+    start, end = SNIPPET_MARKERS
+    try:
+        cursor.execute('''
+            SELECT paper_id, page, bm25(paper_pages_fts) as rank,
+                   snippet(paper_pages_fts, 0, ?, ?, '...', ?) as snippet
+            FROM paper_pages_fts
+            WHERE paper_pages_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (start, end, SNIPPET_TOKENS, match, CONTENT_PAGE_LIMIT))
+        hits = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Content search failed for {text!r}: {e}")
+        return []
+
+    # Group page hits by paper, keeping papers in order of their best page
+    pages_by_paper = {}
+    for hit in hits:
+        pages = pages_by_paper.setdefault(hit['paper_id'], [])
+        if len(pages) < CONTENT_PAGES_PER_PAPER:
+            pages.append({'page': hit['page'], 'snippet': hit['snippet']})
+    paper_ids = list(pages_by_paper)[:limit]
+    if not paper_ids:
+        return []
+
+    placeholders = ','.join('?' * len(paper_ids))
+    cursor.execute(f'''
+        SELECT p.*, s.display_name as subject_name, y.year, r.display_name as region_name
+        FROM papers p
+        JOIN subjects s ON p.subject_id = s.id
+        JOIN years y ON p.year_id = y.id
+        JOIN regions r ON p.region_id = r.id
+        WHERE p.id IN ({placeholders})
+    ''', paper_ids)
+    papers = {row['id']: dict(row) for row in cursor.fetchall()}
+
+    results = []
+    for paper_id in paper_ids:
+        paper = papers.get(paper_id)
+        if paper is not None:
+            paper['pages'] = pages_by_paper[paper_id]
+            results.append(paper)
+    return results
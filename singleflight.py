@@ -0,0 +1,72 @@
+"""Single-flight locking and atomic writes for the on-disk caches
+
+Concurrent cache misses for the same ZIP or paper are coalesced: the first
+caller takes an exclusive lock and does the work, everyone else blocks on
+the same lock and then finds the finished file. The lock is a per-key
+threading lock plus an flock()ed lock file, so it holds across the threads
+of one gunicorn worker and across workers.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock_for(key):
+    """Get the in-process lock for a key"""
+    with _thread_locks_guard:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = _thread_locks[key] = threading.Lock()
+        return lock
+
+@contextmanager
+def single_flight(key, lock_dir):
+    """Hold the exclusive lock for `key` across threads and worker processes"""
+    thread_lock = _thread_lock_for(key)
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_name = hashlib.sha1(key.encode()).hexdigest() + '.lock'
+        with open(os.path.join(lock_dir, lock_name), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def atomic_writer(path, mode='wb'):
+    """Write to a temp file next to `path` and rename it into place on success"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_write_bytes(path, data):
+    """Atomically replace `path` with `data`"""
+    with atomic_writer(path) as f:
+        f.write(data)
@@ -1,8 +1,14 @@
 // CBSE Papers Archive - Main JavaScript
 
+// Paper listing: fields the UI uses, and page sizes for the first and later requests
+const PAPER_FIELDS = 'id,title,subject_name,year,region_name,set_code,paper_type';
+const PAPERS_FIRST_PAGE = 60;
+const PAPERS_FETCH_SIZE = 500;
+
 // State management
 const state = {
     papers: [],
+    papersRequest: 0,
     filteredPapers: [],
     subjects: [],
     years: [],
@@ -109,23 +115,60 @@ async function loadRegions() {
     });
 }
 
-// Load papers from API
+// Load papers from API: render the first page right away, then fetch the rest
 async function loadPapers() {
+    const requestId = ++state.papersRequest;
     const params = new URLSearchParams();
     
     if (state.filters.subject_id) params.append('subject_id', state.filters.subject_id);
     if (state.filters.year_id) params.append('year_id', state.filters.year_id);
     if (state.filters.region_id) params.append('region_id', state.filters.region_id);
     if (state.filters.paper_type) params.append('paper_type', state.filters.paper_type);
+    params.append('fields', PAPER_FIELDS);
+    params.append('limit', PAPERS_FIRST_PAGE);
     
-    const response = await fetch(`/api/papers?${params.toString()}`);
-    state.papers = await response.json();
+    const page = await fetchPapersPage(params);
+    if (requestId !== state.papersRequest) return; // filters changed meanwhile
+    state.papers = page.papers;
     
     // Apply search filter
     applySearchFilter();
     
     // Render papers
     renderPapers();
+    
+    // Lazily load the remaining pages in the background
+    loadRemainingPapers(params, page.next_cursor, requestId)
+        .catch(error => console.error('Error loading papers:', error));
+}
+
+// Fetch the pages after the first one, appending them as they arrive
+async function loadRemainingPapers(params, cursor, requestId) {
+    params.set('limit', PAPERS_FETCH_SIZE);
+    let page = { next_cursor: cursor };
+    while (page.next_cursor) {
+        params.set('cursor', page.next_cursor);
+        page = await fetchPapersPage(params);
+        if (requestId !== state.papersRequest) return;
+        
+        const shownBefore = state.filteredPapers.length;
+        state.papers.push(...page.papers);
+        applySearchFilter();
+        if (shownBefore < state.currentPage * state.papersPerPage) {
+            renderPapers();
+        } else {
+            renderPagination();
+        }
+    }
+}
+
+// Fetch one page of papers
+async function fetchPapersPage(params) {
+    const response = await fetch(`/api/papers?${params.toString()}`);
+    if (!response.ok) {
+        throw new Error(`Failed to load papers (${response.status})`);
+    }
+    return response.json();
 }
 
 // Apply search filter
@@ -0,0 +1,37 @@
+"""Bundles stored under the digest of their bytes"""
+import hashlib
+
+from bundle_cache import BundleCache
+
+def store(cache, key, data):
+    writer = cache.writer(key)
+    writer.write(data)
+    writer.commit()
+
+def test_bundle_is_named_after_its_digest(tmp_path):
+    cache = BundleCache(str(tmp_path), max_bytes=10 ** 6)
+    key = BundleCache.key_for([3, 1, 2], 'stored', 1)
+    store(cache, key, b'first build')
+
+    path = cache.get(key)
+
+    assert BundleCache.etag_for(path) == hashlib.sha256(b'first build').hexdigest()
+    assert cache.get(BundleCache.key_for([1, 2, 3], 'stored', 1)) == path
+
+def test_rebuild_gets_a_new_etag(tmp_path):
+    cache = BundleCache(str(tmp_path), max_bytes=10 ** 6)
+    key = BundleCache.key_for([1], 'stored', 1)
+    store(cache, key, b'first build')
+    first = BundleCache.etag_for(cache.get(key))
+
+    store(cache, key, b'second build')
+
+    assert BundleCache.etag_for(cache.get(key)) != first
+
+def test_evicted_bundle_drops_its_ref(tmp_path):
+    cache = BundleCache(str(tmp_path), max_bytes=0)
+    key = BundleCache.key_for([1], 'stored', 1)
+    store(cache, key, b'too big')
+
+    assert cache.get(key) is None
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,37 @@
+"""LRU eviction, pins and holds"""
+from cache_manager import CacheManager
+
+def make_cache(tmp_path, names):
+    cache = CacheManager(str(tmp_path), max_bytes=100, suffix='.pdf', min_idle=0)
+    for name in names:
+        (tmp_path / name).write_bytes(b'x' * 60)
+        cache.add(str(tmp_path / name))
+    return cache
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, ['a.pdf'])
+    (tmp_path / 'b.pdf').write_bytes(b'x' * 60)
+    cache.add(str(tmp_path / 'b.pdf'))
+
+    assert not (tmp_path / 'a.pdf').exists()
+    assert (tmp_path / 'b.pdf').exists()
+
+def test_pinned_and_held_entries_survive_eviction(tmp_path):
+    cache = make_cache(tmp_path, ['a.pdf'])
+    cache.hold('request', str(tmp_path / 'a.pdf'))
+    (tmp_path / 'b.pdf').write_bytes(b'x' * 60)
+    cache.pin(str(tmp_path / 'b.pdf'))
+    cache.add(str(tmp_path / 'b.pdf'))
+
+    assert (tmp_path / 'a.pdf').exists() and (tmp_path / 'b.pdf').exists()
+
+    cache.release('request')
+    assert cache.evict() == 1
+    assert not (tmp_path / 'a.pdf').exists()
+
+def test_expired_holds_lapse(tmp_path):
+    cache = make_cache(tmp_path, ['a.pdf'])
+    cache.hold('request', str(tmp_path / 'a.pdf'), ttl=-1)
+    cache.max_bytes = 0
+
+    assert cache.evict() == 1
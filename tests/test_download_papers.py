@@ -0,0 +1,43 @@
+"""Harvester archive fetches against a local stand-in server"""
+import os
+import zipfile
+
+import pytest
+
+import download_papers
+from conftest import respond
+
+@pytest.fixture
+def zip_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_papers, 'ZIP_CACHE_DIR', str(tmp_path / 'zip_cache'))
+    monkeypatch.setattr(download_papers, 'LOCK_DIR', str(tmp_path / 'locks'))
+    os.makedirs(tmp_path / 'zip_cache')
+    return tmp_path / 'zip_cache'
+
+def test_archive_that_is_not_a_zip_is_dropped(server, zip_cache):
+    # An error page served as the archive, with validators that would match next time
+    server.routes['/a.zip'] = lambda handler: respond(
+        handler, 200, b'<html>Service unavailable</html>',
+        {'ETag': '"error-page"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    )
+
+    for _ in range(2):
+        with pytest.raises(zipfile.BadZipFile):
+            download_papers.fetch_archive(server.url('/a.zip'))
+        assert not any(zip_cache.iterdir())
+
+    assert len(server.requests) == 2
+    assert 'If-None-Match' not in server.requests[1][1]
+
+def test_local_files_are_ordered_by_numeric_series(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_papers, 'PAPERS_DIR', str(tmp_path))
+    os.makedirs(tmp_path / '2024')
+    for name in ('accountancy_2024_67-10-1.pdf', 'accountancy_2024_67-2-1.pdf'):
+        (tmp_path / '2024' / name).write_bytes(b'%PDF-')
+
+    index = download_papers.index_local_files([2024])
+
+    files = index[('accountancy', 2024, '1', 'question_paper')]
+    assert [os.path.basename(path) for _, path, _ in files] == [
+        'accountancy_2024_67-2-1.pdf', 'accountancy_2024_67-10-1.pdf'
+    ]
@@ -0,0 +1,165 @@
+"""Fetcher downloads against a local stand-in server"""
+import gzip
+import hashlib
+import json
+import os
+
+import pytest
+
+from conftest import respond
+from fetch import Fetcher, FetchError, PART_SUFFIX, VALIDATORS_SUFFIX, load_validators, parse_range_total
+
+BODY = os.urandom(200 * 1024)
+ETAG = '"v1"'
+
+def archive_route(body=BODY, etag=ETAG):
+    """Serve `body` with an ETag, honouring If-None-Match, Range and If-Range"""
+    def route(handler):
+        if handler.headers.get('If-None-Match') == etag:
+            respond(handler, 304, headers={'ETag': etag})
+            return
+        range_header = handler.headers.get('Range')
+        if range_header and handler.headers.get('If-Range') in (None, etag):
+            start = int(range_header.split('=')[1].split('-')[0])
+            if start >= len(body):
+                respond(handler, 416, headers={'Content-Range': f"bytes */{len(body)}"})
+                return
+            respond(handler, 206, body[start:], {
+                'ETag': etag, 'Content-Range': f"bytes {start}-{len(body) - 1}/{len(body)}",
+            })
+            return
+        respond(handler, 200, body, {'ETag': etag})
+    return route
+
+def write_partial(dest, data, etag=ETAG):
+    """Leave a .part file as an interrupted download would"""
+    with open(dest + PART_SUFFIX, 'wb') as f:
+        f.write(data)
+    with open(dest + PART_SUFFIX + VALIDATORS_SUFFIX, 'w') as f:
+        json.dump({'etag': etag}, f)
+
+@pytest.fixture
+def fetcher():
+    return Fetcher(max_retries=2, backoff_base=0.001)
+
+def test_get(server, fetcher):
+    server.routes['/a.zip'] = archive_route()
+
+    response = fetcher.get(server.url('/a.zip'))
+
+    assert response.status_code == 200
+    assert response.content == BODY
+    assert response.headers['ETag'] == ETAG
+
+def test_get_not_modified(server, fetcher):
+    server.routes['/a.zip'] = archive_route()
+
+    response = fetcher.get(server.url('/a.zip'), validators={'etag': ETAG})
+
+    assert response.status_code == 304
+    assert server.requests[-1][1]['If-None-Match'] == ETAG
+
+def test_server_errors_are_retried(server, fetcher):
+    calls = []
+    def route(handler):
+        calls.append(1)
+        if len(calls) == 1:
+            respond(handler, 503)
+        else:
+            archive_route()(handler)
+    server.routes['/a.zip'] = route
+
+    assert fetcher.get(server.url('/a.zip')).status_code == 200
+    assert len(calls) == 2
+
+def test_retries_are_bounded(server, fetcher):
+    server.routes['/a.zip'] = lambda handler: respond(handler, 503)
+
+    assert fetcher.get(server.url('/a.zip')).status_code == 503
+    assert len(server.requests) == 3
+
+def test_full_download(server, fetcher, tmp_path):
+    server.routes['/a.zip'] = archive_route()
+    dest = str(tmp_path / 'a.zip')
+
+    result = fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    assert result['status'] == 200
+    assert result['sha256'] == hashlib.sha256(BODY).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert load_validators(dest)['etag'] == ETAG
+    assert not os.path.exists(dest + PART_SUFFIX)
+
+def test_not_modified(server, fetcher, tmp_path):
+    server.routes['/a.zip'] = archive_route()
+    dest = str(tmp_path / 'a.zip')
+    fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    result = fetcher.download_to_file(server.url('/a.zip'), dest, validators=load_validators(dest))
+
+    assert result['status'] == 304
+    assert server.requests[-1][1]['If-None-Match'] == ETAG
+
+def test_resumes_partial_download(server, fetcher, tmp_path):
+    server.routes['/a.zip'] = archive_route()
+    dest = str(tmp_path / 'a.zip')
+    write_partial(dest, BODY[:1000])
+
+    result = fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    assert result['sha256'] == hashlib.sha256(BODY).hexdigest()
+    assert server.requests[0][1]['Range'] == 'bytes=1000-'
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+def test_unknown_range_total(server, fetcher, tmp_path):
+    def route(handler):
+        respond(handler, 206, BODY[1000:], {'ETag': ETAG, 'Content-Range': f"bytes 1000-{len(BODY) - 1}/*"})
+    server.routes['/a.zip'] = route
+    dest = str(tmp_path / 'a.zip')
+    write_partial(dest, BODY[:1000])
+
+    fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert parse_range_total('bytes 0-9/*') is None
+    assert parse_range_total('bytes 0-9/10') == 10
+
+def test_unsatisfiable_range_restarts(server, fetcher, tmp_path):
+    server.routes['/a.zip'] = archive_route()
+    dest = str(tmp_path / 'a.zip')
+    # A partial copy longer than the resource no longer lines up with it
+    write_partial(dest, BODY + b'stale')
+
+    result = fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    assert result['status'] == 200
+    assert [headers.get('Range') for _, headers in server.requests] == [f"bytes={len(BODY) + 5}-", None]
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+def test_restarts_are_bounded(server, fetcher, tmp_path):
+    server.routes['/a.zip'] = lambda handler: respond(handler, 416)
+    dest = str(tmp_path / 'a.zip')
+
+    with pytest.raises(FetchError):
+        fetcher.download_to_file(server.url('/a.zip'), dest)
+    assert len(server.requests) == fetcher.max_retries + 1
+
+def test_content_encoding_is_not_decoded(server, fetcher, tmp_path):
+    # A server that compresses regardless of Accept-Encoding
+    compressed = gzip.compress(BODY)
+    server.routes['/a.zip'] = lambda handler: respond(handler, 200, compressed, {
+        'ETag': ETAG, 'Content-Encoding': 'gzip',
+    })
+    dest = str(tmp_path / 'a.zip')
+
+    result = fetcher.download_to_file(server.url('/a.zip'), dest)
+
+    assert result['size'] == len(compressed)
+    assert len(server.requests) == 1
+    assert server.requests[0][1]['Accept-Encoding'] == 'identity'
+    with open(dest, 'rb') as f:
+        assert f.read() == compressed
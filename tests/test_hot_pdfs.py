@@ -0,0 +1,41 @@
+"""Admission to the shared-memory PDF tier"""
+import hot_pdfs
+from hot_pdfs import HotPdfCache
+
+def make_source(tmp_path, paper_id):
+    path = tmp_path / f'source_{paper_id}.pdf'
+    path.write_bytes(b'%PDF-' + bytes([paper_id]) * 1000)
+    return str(path)
+
+def test_admits_after_min_requests(tmp_path):
+    tier = HotPdfCache(str(tmp_path / 'hot'), max_papers=1, min_requests=2)
+    source = make_source(tmp_path, 1)
+
+    assert tier.request(1, source) == source
+    assert tier.request(1, source) == source
+    assert tier.request(1, source) == tier.path_for(1)
+
+def test_does_not_drop_residents_still_being_served(tmp_path):
+    tier = HotPdfCache(str(tmp_path / 'hot'), max_papers=1, min_requests=1)
+    first, second = make_source(tmp_path, 1), make_source(tmp_path, 2)
+    tier.request(1, first)
+    tier.request(1, first)
+
+    for _ in range(3):
+        assert tier.request(2, second) == second
+
+    assert tier.stats()['papers'] == 1
+    assert not (tmp_path / 'hot' / 'paper_2.pdf').exists()
+
+def test_replaces_idle_residents(tmp_path, monkeypatch):
+    monkeypatch.setattr(hot_pdfs, 'EVICT_MIN_IDLE', -1)
+    tier = HotPdfCache(str(tmp_path / 'hot'), max_papers=1, min_requests=1)
+    first, second = make_source(tmp_path, 1), make_source(tmp_path, 2)
+    tier.request(1, first)
+
+    for _ in range(3):
+        tier.request(2, second)
+
+    assert tier.request(2, second) == tier.path_for(2)
+    assert tier.stats()['papers'] == 1
+    assert not (tmp_path / 'hot' / 'paper_1.pdf').exists()
@@ -0,0 +1,51 @@
+"""Archive member index and lookups"""
+import os
+import zipfile
+
+from zip_index import build_zip_index, find_member, load_zip_index, read_member, read_members
+
+def make_archive(path, names, compression=zipfile.ZIP_DEFLATED):
+    contents = {name: b'%PDF-' + name.encode() + os.urandom(5000) for name in names}
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for name, content in contents.items():
+            zf.writestr(name, content)
+    return contents
+
+def test_index_and_read(tmp_path):
+    path = str(tmp_path / 'a.zip')
+    contents = make_archive(path, ['X/67-1-1.pdf', 'X/67-1-2.pdf', 'X/readme.txt'])
+
+    index = build_zip_index(path)
+
+    assert [m['name'] for m in index['members']] == ['X/67-1-1.pdf', 'X/67-1-2.pdf']
+    assert load_zip_index(path) == index
+    member = index['members'][1]
+    assert member['paper_code'] == '67-1-2' and member['set_num'] == '2'
+    assert read_member(path, member) == contents['X/67-1-2.pdf']
+    assert {m['name']: data for m, data in read_members(path, index['members'])} == {
+        name: content for name, content in contents.items() if name.endswith('.pdf')
+    }
+
+def test_find_member_prefers_lowest_series(tmp_path):
+    path = str(tmp_path / 'a.zip')
+    make_archive(path, ['X/67-10-2.pdf', 'X/67-2-2.pdf', 'X/67-2-1.pdf'])
+    index = build_zip_index(path)
+
+    assert find_member(index, 'Set 2')['name'] == 'X/67-2-2.pdf'
+    assert find_member(index, 'Set 1')['name'] == 'X/67-2-1.pdf'
+    # No match falls back to the first member
+    assert find_member(index, 'Set 9')['name'] == 'X/67-10-2.pdf'
+
+def test_read_members_skips_bad_members(tmp_path):
+    path = str(tmp_path / 'a.zip')
+    contents = make_archive(path, ['X/67-1-1.pdf', 'X/67-1-2.pdf', 'X/67-1-3.pdf'], zipfile.ZIP_STORED)
+    index = build_zip_index(path)
+    bad = dict(index['members'][0], crc=index['members'][0]['crc'] ^ 1)
+    errors = []
+
+    read = list(read_members(path, [bad] + index['members'][1:], on_error=lambda m, e: errors.append(m['name'])))
+
+    assert errors == ['X/67-1-1.pdf']
+    assert [(m['name'], data) for m, data in read] == [
+        (name, contents[name]) for name in ('X/67-1-2.pdf', 'X/67-1-3.pdf')
+    ]
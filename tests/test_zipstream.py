@@ -0,0 +1,69 @@
+"""Streamed ZIP output read back through zipfile"""
+import io
+import os
+import zipfile
+
+import pytest
+
+from zipstream import FLAG_DATA_DESCRIPTOR, ZipStream, can_copy_raw
+from zip_index import build_zip_index, iter_member_raw
+
+def build(stream, *entries):
+    data = b''.join(b''.join(entry) for entry in entries) + b''.join(stream.finish())
+    return zipfile.ZipFile(io.BytesIO(data))
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_round_trip(tmp_path, compression):
+    pdf = tmp_path / 'paper.pdf'
+    content = b'%PDF-' + os.urandom(150 * 1024)
+    pdf.write_bytes(content)
+    stream = ZipStream(compression=compression)
+
+    zf = build(stream, stream.add_file('paper.pdf', str(pdf)), stream.add_bytes('notes.txt', b'hello'))
+
+    assert zf.testzip() is None
+    assert zf.read('paper.pdf') == content
+    assert zf.read('notes.txt') == b'hello'
+    for info in zf.infolist():
+        assert info.compress_type == compression
+        # Stored entries carry their sizes up front; only deflated ones stream a descriptor
+        assert bool(info.flag_bits & FLAG_DATA_DESCRIPTOR) == (compression == zipfile.ZIP_DEFLATED)
+
+def test_stored_local_header_has_sizes(tmp_path):
+    pdf = tmp_path / 'paper.pdf'
+    pdf.write_bytes(b'x' * 1000)
+    stream = ZipStream(compression=zipfile.ZIP_STORED)
+    data = b''.join(stream.add_file('paper.pdf', str(pdf)))
+
+    # Local header: CRC at 14, compressed and uncompressed sizes at 18 and 22
+    assert int.from_bytes(data[18:22], 'little') == 1000
+    assert int.from_bytes(data[22:26], 'little') == 1000
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_add_raw_copies_members(tmp_path, compression):
+    source = tmp_path / 'source.zip'
+    members = {f'X/67-1-{n}.pdf': b'%PDF-' + os.urandom(20 * 1024) + b'a' * 40000 for n in (1, 2)}
+    with zipfile.ZipFile(source, 'w', compression) as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    index = build_zip_index(str(source))
+    stream = ZipStream(compression=zipfile.ZIP_STORED)
+
+    entries = [
+        stream.add_raw(os.path.basename(m['name']), iter_member_raw(str(source), m),
+                       m['compress_type'], m['crc'], m['compress_size'], m['file_size'])
+        for m in index['members']
+    ]
+    zf = build(stream, *entries)
+
+    assert zf.testzip() is None
+    for name, content in members.items():
+        assert zf.read(os.path.basename(name)) == content
+        assert zf.getinfo(os.path.basename(name)).compress_type == compression
+
+def test_add_raw_rejects_unsupported_methods():
+    member = {'compress_type': zipfile.ZIP_BZIP2, 'compress_size': 10, 'file_size': 10}
+    assert not can_copy_raw(member)
+    assert can_copy_raw(dict(member, compress_type=zipfile.ZIP_DEFLATED))
+    with pytest.raises(ValueError):
+        list(ZipStream().add_raw('a.pdf', [b'x' * 10], zipfile.ZIP_BZIP2, 0, 10, 10))
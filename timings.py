@@ -0,0 +1,48 @@
+"""Per-stage wall-clock timings for multi-step requests
+
+Stages timed from several threads (e.g. one archive fetch per worker) are
+summed, so a stage can add up to more than the request's elapsed time.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+class StageTimings:
+    """Thread-safe accumulator of time spent per named stage"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with-block as part of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Format the stages as a Server-Timing header value"""
+        with self.lock:
+            return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+    def summary(self):
+        """Format the stages for a log line"""
+        with self.lock:
+            parts = []
+            for name, seconds in self.stages.items():
+                count = self.counts[name]
+                parts.append(f"{name} {seconds * 1000:.0f}ms" + (f" (x{count})" if count > 1 else ''))
+        return ', '.join(parts) + f"; total {self.elapsed() * 1000:.0f}ms"
@@ -0,0 +1,174 @@
+"""Central-directory index for cached CBSE ZIP archives
+
+Each archive in zip_cache/ gets a JSON sidecar describing its PDF members
+(local header offset, sizes, compression, CRC and parsed paper code), so a
+single paper can be extracted by seeking straight to its member instead of
+loading and rescanning the whole archive.
+"""
+import os
+import json
+import zlib
+import struct
+import hashlib
+import zipfile
+from collections import namedtuple
+from paper_urls import parse_paper_code, parse_set_number, paper_code_sort_key
+from singleflight import atomic_writer
+
+INDEX_SUFFIX = '.index.json'
+CHUNK_SIZE = 64 * 1024
+INDEX_VERSION = 1
+
+# Local file header: signature, versions, flags, method, time, date, crc,
+# sizes, name length, extra length
+LOCAL_HEADER_STRUCT = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+# A member of a cached archive, used to copy its compressed bytes verbatim
+ZipMemberRef = namedtuple('ZipMemberRef', ['zip_path', 'member'])
+
+def zip_cache_path(url, cache_dir):
+    """Get the zip_cache/ path an archive URL is stored under"""
+    cache_key = hashlib.md5(url.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{cache_key}.zip")
+
+def index_path_for(zip_path):
+    """Get the sidecar index path for a cached archive"""
+    return zip_path + INDEX_SUFFIX
+
+def build_zip_index(zip_path):
+    """Read an archive's central directory and write its member index"""
+    stat = os.stat(zip_path)
+    members = []
+
+    # ZipFile only parses the central directory here, not the member data
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.pdf'):
+                continue
+            code = parse_paper_code(info.filename)
+            members.append({
+                'name': info.filename,
+                'header_offset': info.header_offset,
+                'compress_size': info.compress_size,
+                'file_size': info.file_size,
+                'compress_type': info.compress_type,
+                'crc': info.CRC,
+                'paper_code': '-'.join(code) if code else None,
+                'set_num': parse_set_number(info.filename),
+            })
+
+    index = {
+        'version': INDEX_VERSION,
+        'zip_size': stat.st_size,
+        'zip_mtime': stat.st_mtime,
+        'members': members,
+    }
+
+    with atomic_writer(index_path_for(zip_path), 'w') as f:
+        json.dump(index, f)
+    return index
+
+def load_zip_index(zip_path):
+    """Load an archive's member index, rebuilding it if missing or stale"""
+    try:
+        with open(index_path_for(zip_path)) as f:
+            index = json.load(f)
+        stat = os.stat(zip_path)
+        if (index.get('version') == INDEX_VERSION
+                and index.get('zip_size') == stat.st_size
+                and index.get('zip_mtime') == stat.st_mtime):
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_zip_index(zip_path)
+
+def member_series_key(member):
+    """Sort key putting members in numeric series order (67-2-2 before 67-10-2)"""
+    return paper_code_sort_key(member['paper_code'], member['name'])
+
+def find_member(index, set_code):
+    """Pick the archive member for a paper set (e.g. "Set 2")"""
+    members = index['members']
+    if not members:
+        return None
+
+    set_num = set_code.replace('Set ', '') if set_code else '1'
+
+    # Prefer the parsed paper code, lowest series first
+    matches = [m for m in members if m['set_num'] == set_num]
+    if matches:
+        return min(matches, key=member_series_key)
+
+    # Fall back to loose filename matching for irregular names
+    for member in members:
+        name_lower = member['name'].lower()
+        if f'-{set_num}-' in name_lower or f'_{set_num}_' in name_lower or f'set{set_num}' in name_lower:
+            return member
+
+    # If no specific match, return first PDF
+    return members[0]
+
+def member_data_offset(f, member):
+    """Get the offset of a member's data, given an open archive file"""
+    f.seek(member['header_offset'])
+    header = f.read(LOCAL_HEADER_STRUCT.size)
+    if len(header) != LOCAL_HEADER_STRUCT.size:
+        raise zipfile.BadZipFile(f"Truncated local header for {member['name']}")
+    fields = LOCAL_HEADER_STRUCT.unpack(header)
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header signature for {member['name']}")
+    name_length, extra_length = fields[10], fields[11]
+    return member['header_offset'] + LOCAL_HEADER_STRUCT.size + name_length + extra_length
+
+def read_member(zip_path, member):
+    """Read and decompress a single member, touching only its bytes on disk"""
+    with open(zip_path, 'rb') as f:
+        return _read_member_from(f, zip_path, member)
+
+def read_members(zip_path, members, on_error=None):
+    """Yield (member, data) for several members, reading the archive once in offset order
+
+    With `on_error`, a member that cannot be read (bad CRC, unsupported
+    method) is passed to on_error(member, exc) and skipped instead of ending
+    the pass.
+    """
+    with open(zip_path, 'rb') as f:
+        for member in sorted(members, key=lambda m: m['header_offset']):
+            try:
+                data = _read_member_from(f, zip_path, member)
+            except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, EOFError) as e:
+                if on_error is None:
+                    raise
+                on_error(member, e)
+                continue
+            yield member, data
+
+def _read_member_from(f, zip_path, member):
+    f.seek(member_data_offset(f, member))
+    raw = f.read(member['compress_size'])
+
+    if member['compress_type'] == zipfile.ZIP_STORED:
+        data = raw
+    elif member['compress_type'] == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(raw, -zlib.MAX_WBITS)
+    else:
+        # Rare methods (bzip2/lzma) go through zipfile
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            return zf.read(member['name'])
+
+    if zlib.crc32(data) != member['crc']:
+        raise zipfile.BadZipFile(f"CRC mismatch for {member['name']}")
+    return data
+
+def iter_member_raw(zip_path, member, chunk_size=CHUNK_SIZE):
+    """Yield a member's compressed bytes without decompressing them"""
+    with open(zip_path, 'rb') as f:
+        f.seek(member_data_offset(f, member))
+        remaining = member['compress_size']
+        while remaining:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated data for {member['name']}")
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,200 @@
+"""Streaming ZIP writer for bulk paper downloads
+
+Deflated entries are written with data descriptors, so their sizes and
+CRCs are not needed up front and the archive can be sent to the client while
+it is being built. Stored entries get their CRC and size in the local header
+(computed in a first pass over the file), since many streaming unzippers
+reject stored entries with data descriptors. Only one chunk of one entry is
+held in memory at a time. Members copied from another archive keep their
+compressed bytes and are never recompressed.
+"""
+import os
+import time
+import zlib
+import struct
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+DATA_DESCRIPTOR = struct.Struct('<4s3L')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP16_LIMIT = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# Compression methods whose data add_raw can copy verbatim
+RAW_COPY_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+def _dos_datetime(timestamp):
+    """Convert a Unix timestamp into ZIP (DOS) date and time fields"""
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return dos_date, dos_time
+
+def can_copy_raw(member):
+    """Check whether an archive member's compressed bytes can go through add_raw"""
+    return (member['compress_type'] in RAW_COPY_METHODS
+            and member['compress_size'] <= ZIP32_LIMIT and member['file_size'] <= ZIP32_LIMIT)
+
+def _read_chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+class ZipStream:
+    """Build a ZIP archive incrementally, yielding its bytes as entries are added"""
+
+    def __init__(self, compression=zipfile.ZIP_DEFLATED, compresslevel=6):
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.offset = 0
+        self.entries = []
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def add_file(self, arcname, path, compress_type=None):
+        """Yield the archive bytes for a file on disk"""
+        if compress_type is None:
+            compress_type = self.compression
+        with open(path, 'rb') as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            if compress_type == zipfile.ZIP_STORED:
+                crc = 0
+                size = 0
+                for chunk in _read_chunks(f):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                f.seek(0)
+                yield from self.add_raw(arcname, _read_chunks(f), zipfile.ZIP_STORED, crc, size, size, mtime)
+            else:
+                yield from self._add_entry(arcname, _read_chunks(f), mtime, compress_type)
+
+    def add_bytes(self, arcname, data, compress_type=None):
+        """Yield the archive bytes for an in-memory entry"""
+        if compress_type is None:
+            compress_type = self.compression
+        if compress_type == zipfile.ZIP_STORED:
+            yield from self.add_raw(arcname, [data], zipfile.ZIP_STORED, zlib.crc32(data),
+                                    len(data), len(data), time.time())
+        else:
+            yield from self._add_entry(arcname, [data], time.time(), compress_type)
+
+    def add_raw(self, arcname, chunks, compress_type, crc, compress_size, file_size, mtime=None):
+        """Yield the archive bytes for already-compressed member data, copied as-is"""
+        if compress_type not in RAW_COPY_METHODS:
+            raise ValueError(f"Unsupported compression method: {compress_type}")
+        if file_size > ZIP32_LIMIT or compress_size > ZIP32_LIMIT:
+            raise ValueError(f"{arcname} is too large for a streamed ZIP entry")
+
+        # Sizes and CRC are known, so they go in the local header directly
+        entry = self._new_entry(arcname, 0, compress_type, time.time() if mtime is None else mtime)
+        entry.update(crc=crc, compress_size=compress_size, file_size=file_size)
+        yield self._emit(self._local_header(entry))
+
+        copied = 0
+        for chunk in chunks:
+            copied += len(chunk)
+            yield self._emit(chunk)
+        if copied != compress_size:
+            raise ValueError(f"{arcname}: expected {compress_size} bytes, got {copied}")
+
+        self.entries.append(entry)
+
+    def _new_entry(self, arcname, flags, compress_type, mtime):
+        name = arcname.encode('utf-8')
+        if not arcname.isascii():
+            flags |= FLAG_UTF8
+        dos_date, dos_time = _dos_datetime(mtime)
+        return {
+            'name': name, 'flags': flags, 'compress_type': compress_type,
+            'dos_time': dos_time, 'dos_date': dos_date, 'crc': 0,
+            'compress_size': 0, 'file_size': 0, 'header_offset': self.offset,
+        }
+
+    def _local_header(self, entry):
+        return LOCAL_HEADER.pack(
+            b'PK\x03\x04', 20, entry['flags'], entry['compress_type'],
+            entry['dos_time'], entry['dos_date'],
+            entry['crc'], entry['compress_size'], entry['file_size'], len(entry['name']), 0
+        ) + entry['name']
+
+    def _add_entry(self, arcname, chunks, mtime, compress_type):
+        if compress_type is None:
+            compress_type = self.compression
+        if compress_type != zipfile.ZIP_DEFLATED:
+            raise ValueError(f"Unsupported compression method for a streamed entry: {compress_type}")
+
+        entry = self._new_entry(arcname, FLAG_DATA_DESCRIPTOR, compress_type, mtime)
+        yield self._emit(self._local_header(entry))
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            chunk = compressor.compress(chunk)
+            if chunk:
+                compress_size += len(chunk)
+                yield self._emit(chunk)
+        tail = compressor.flush()
+        compress_size += len(tail)
+        if tail:
+            yield self._emit(tail)
+
+        if file_size > ZIP32_LIMIT or compress_size > ZIP32_LIMIT:
+            raise ValueError(f"{arcname} is too large for a streamed ZIP entry")
+
+        yield self._emit(DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, compress_size, file_size))
+
+        entry.update(crc=crc, compress_size=compress_size, file_size=file_size)
+        self.entries.append(entry)
+
+    def finish(self):
+        """Yield the central directory that closes the archive"""
+        cd_offset = self.offset
+        for entry in self.entries:
+            extra = b''
+            header_offset = entry['header_offset']
+            version = 20
+            if header_offset > ZIP32_LIMIT:
+                # Zip64 extended information carrying the real offset
+                extra = struct.pack('<2HQ', 0x0001, 8, header_offset)
+                header_offset = ZIP32_LIMIT
+                version = 45
+            yield self._emit(CENTRAL_HEADER.pack(
+                b'PK\x01\x02', version, version, entry['flags'], entry['compress_type'],
+                entry['dos_time'], entry['dos_date'], entry['crc'],
+                entry['compress_size'], entry['file_size'],
+                len(entry['name']), len(extra), 0, 0, 0, 0o100644 << 16, header_offset
+            ) + entry['name'] + extra)
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+
+        if count > ZIP16_LIMIT or cd_offset > ZIP32_LIMIT or cd_size > ZIP32_LIMIT:
+            zip64_offset = self.offset
+            yield self._emit(ZIP64_END_RECORD.pack(
+                b'PK\x06\x06', ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                count, count, cd_size, cd_offset
+            ))
+            yield self._emit(ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, zip64_offset, 1))
+            count = min(count, ZIP16_LIMIT)
+            cd_size = min(cd_size, ZIP32_LIMIT)
+            cd_offset = min(cd_offset, ZIP32_LIMIT)
+
+        yield self._emit(END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, cd_size, cd_offset, 0))